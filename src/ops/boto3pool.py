@@ -0,0 +1,126 @@
+# Copyright 2019 Adobe. All rights reserved.
+# This file is licensed to you under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+
+import logging
+import threading
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+
+class Boto3Pool(object):
+    """
+    Process wide cache of boto3 sessions and clients, keyed by (profile, region, service)
+
+    Creating a session or a client loads the botocore models and takes 50-200ms,
+    so they are created once and shared. Clients are thread safe, sessions are
+    not: everything created from the same profile is serialized by a per profile lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profile_locks = {}
+        self._sessions = {}
+        self._clients = {}
+        self._configs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def session(self, profile=None):
+        with self._get_profile_lock(profile):
+            session = self._sessions.get(profile)
+            if session is None:
+                session = self._sessions[profile] = boto3.Session(profile_name=profile)
+
+            return session
+
+    def client(self, service, profile=None, region=None):
+        key = (profile, region, service)
+        client = self._clients.get(key)
+        if client is not None:
+            self._count(hit=True)
+            return client
+
+        with self._get_profile_lock(profile):
+            client = self._clients.get(key)
+            if client is None:
+                self._count(hit=False)
+                client = self._clients[key] = self.session(profile).client(
+                    service, region_name=region, config=self._configs.get(service))
+            else:
+                self._count(hit=True)
+
+            return client
+
+    def configure(self, service, config):
+        """ Sets the botocore Config of the clients of a service, the existing ones are dropped """
+        with self._lock:
+            self._configs[service] = config
+            for key in [key for key in self._clients if key[2] == service]:
+                del self._clients[key]
+
+    def warm_up(self, keys, background=True):
+        """ Creates the clients for the given (profile, region, service) keys ahead of time
+
+        With background=True this happens in daemon threads, one per profile, while
+        the caller carries on; later calls to client() wait for the ones in progress
+        """
+
+        by_profile = {}
+        for profile, region, service in keys:
+            by_profile.setdefault(profile, []).append((service, region))
+
+        def create(profile, clients):
+            for service, region in clients:
+                try:
+                    self.client(service, profile, region)
+                except Exception as e:
+                    logger.debug("Could not warm up %s client for %s/%s: %s",
+                                 service, profile, region, e)
+
+        if not background:
+            for profile, clients in by_profile.items():
+                create(profile, clients)
+            return []
+
+        threads = [threading.Thread(target=create, args=(profile, clients))
+                   for profile, clients in by_profile.items()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        return threads
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    sessions=len(self._sessions), clients=len(self._clients))
+
+    def clear(self):
+        with self._lock:
+            self._profile_locks.clear()
+            self._sessions.clear()
+            self._clients.clear()
+            self._configs.clear()
+            self.hits = self.misses = 0
+
+    def _get_profile_lock(self, profile):
+        with self._lock:
+            return self._profile_locks.setdefault(profile, threading.RLock())
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+pool = Boto3Pool()
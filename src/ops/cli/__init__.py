@@ -24,8 +24,8 @@ def get_output(command, trim=True):
 def display(msg, **kwargs):
     # use ansible pretty printer if available
     try:
-        from ansible.playbook.play import display
-        display.display(msg, **kwargs)
+        from ansible.utils.display import Display
+        Display().display(msg, **kwargs)
     except ImportError:
         print(msg)
 
@@ -11,8 +11,7 @@
 import yaml
 import logging
 
-from ansible.parsing.yaml.dumper import AnsibleDumper
-from ansible.utils.color import stringc
+from ops.inventory.cachemanager import InventoryCacheManager
 from . import display
 from .parser import configure_common_arguments, SubParserConfig
 
@@ -35,20 +34,30 @@ class InventoryParserConfig(SubParserConfig):
                             help='Limit run to a specific server subgroup. Eg: --limit newton-dcs')
         parser.add_argument('--facts', default=False, action='store_true',
                             help='Show inventory facts for the given hosts')
+        parser.add_argument('--gc', default=False, action='store_true',
+                            help='Remove the generated inventory dirs that are no longer used '
+                                 'from the cache dir')
 
         return parser
 
 
 class InventoryRunner(object):
-    def __init__(self, ansible_inventory, cluster_name):
+    def __init__(self, host_index, cluster_name, ops_config):
         """
-        :type ansible_inventory: ops.inventory.generator.AnsibleInventory
+        :type host_index: ops.inventory.hostindex.HostIndex
         """
-        self.ansible_inventory = ansible_inventory
+        self.host_index = host_index
         self.cluster_name = cluster_name
+        self.ops_config = ops_config
 
     def run(self, args, extra_args):
+        from ansible.utils.color import stringc
+
         logger.info("Found extra_args %s", extra_args)
+        if args.gc:
+            self.collect_garbage()
+            return
+
         for host in self.get_inventory_hosts(args):
             group_names = [group.name for group in host.get_groups()]
             group_names = sorted(group_names)
@@ -63,12 +72,25 @@ class InventoryRunner(object):
             if args.facts:
                 display(self.get_host_facts(host))
 
+    def collect_garbage(self):
+        cache_manager = InventoryCacheManager(self.ops_config)
+        result = cache_manager.collect()
+        display("Removed %d of %d generated inventory dirs from %s, %.1f MB freed" %
+                (result['removed'], result['dirs'], cache_manager.cache_dir,
+                 result['freed'] / 1024.0 / 1024),
+                color='green')
+
     def get_inventory_hosts(self, args):
         limit = args.limit or 'all'
 
-        return self.ansible_inventory.get_hosts(limit)
+        # the index only has a few vars of each host, the facts need the full inventory
+        if args.facts:
+            return self.host_index.ansible_inventory.get_hosts(limit)
+        return self.host_index.get_hosts(limit)
 
     def get_host_facts(self, host, indent="\t"):
+        from ansible.parsing.yaml.dumper import AnsibleDumper
+
         vars = host.get_vars()
         ret = yaml.dump(
             vars,
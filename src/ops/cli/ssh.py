@@ -13,7 +13,7 @@ from subprocess import call
 from . import display
 from .parser import SubParserConfig
 from .parser import configure_common_arguments
-from ansible.inventory.host import Host
+from ops.inventory.hostindex import IndexedHost
 from ops.inventory.sshconfig import SshConfigGenerator
 
 from . import err
@@ -149,16 +149,16 @@ class SshParserConfig(SubParserConfig):
 class SshRunner(object):
 
     def __init__(self, cluster_config_path, cluster_config,
-                 ansible_inventory, ops_config, cluster_name, root_dir):
+                 host_index, ops_config, cluster_name, root_dir):
         """
-        :type ansible_inventory: ops.inventory.generator.AnsibleInventory
+        :type host_index: ops.inventory.hostindex.HostIndex
         """
 
         self.root_dir = root_dir
         self.cluster_name = cluster_name
         self.ops_config = ops_config
         self.cluster_config = cluster_config
-        self.ansible_inventory = ansible_inventory
+        self.host_index = host_index
 
     def run(self, args, extra_args):
         logger.info("Found extra_args %s", extra_args)
@@ -215,10 +215,10 @@ class SshRunner(object):
         if args.index < 0:
             args.index = 0
 
-        hosts = self.ansible_inventory.get_hosts(group)
+        hosts = self.host_index.get_hosts(group)
         if len(hosts) <= args.index:
             group = args.role
-            hosts = self.ansible_inventory.get_hosts(group)
+            hosts = self.host_index.get_hosts(group)
             if not hosts:
                 display(
                     "No host found in inventory, using provided name %s" %
@@ -232,7 +232,7 @@ class SshRunner(object):
         host = None
         if host_names:
             if args.index < len(host_names):
-                host = self.ansible_inventory.get_host(host_names[args.index])
+                host = self.host_index.get_host(host_names[args.index])
             else:
                 display(
                     "Index out of bounds for %s" %
@@ -242,9 +242,9 @@ class SshRunner(object):
             ssh_host = host.vars.get('ansible_ssh_host') or host.name
         else:
             # no host found in inventory, use the role provided
-            bastion = self.ansible_inventory.get_hosts(
+            bastion = self.host_index.get_hosts(
                 'bastion')[0].vars.get('ansible_ssh_host')
-            host = Host(name=args.role)
+            host = IndexedHost(args.role, {})
             ssh_host = f'{bastion}--{host.name}'
         ssh_user = self.cluster_config.get('ssh_user') or self.ops_config.get(
             'ssh.user') or getpass.getuser()
@@ -256,15 +256,15 @@ class SshRunner(object):
         if args.nossh:
             args.tunnel = True
             args.ipaddress = True
-            ssh_host = self.ansible_inventory.get_hosts(
+            ssh_host = self.host_index.get_hosts(
                 'bastion')[0].vars.get('ansible_ssh_host')
 
         # if args.tunnel or args.proxy:
         #     ssh_config = args.ssh_config or 'ssh.tunnel.config'
         # else:
-        #     ssh_config = args.ssh_config or self.ansible_inventory.get_ssh_config()
+        #     ssh_config = args.ssh_config or self.host_index.get_ssh_config()
         ssh_config = args.ssh_config or self.ops_config.get(
-            'ssh.config') or self.ansible_inventory.get_ssh_config()
+            'ssh.config') or self.host_index.get_ssh_config()
 
         ssh_host_bastion, ssh_host_dest = None, None
         if args.ssh_dest_user:
@@ -304,7 +304,7 @@ class SshRunner(object):
         if args.proxy:
             if scb_enabled:
                 proxy_port = args.local or SshConfigGenerator.generate_ssh_scb_proxy_port(
-                    self.ansible_inventory.generated_path.removesuffix("/inventory"),
+                    self.host_index.generated_path.removesuffix("/inventory"),
                     args.auto_scb_port,
                     scb_proxy_port
                 )
@@ -60,13 +60,13 @@ class SyncParserConfig(SubParserConfig):
 class SyncRunner(object):
 
     def __init__(self, cluster_config, root_dir,
-                 ansible_inventory, inventory_generator, ops_config):
+                 host_index, inventory_generator, ops_config):
         """
-        :type ansible_inventory: ops.inventory.generator.AnsibleInventory
+        :type host_index: ops.inventory.hostindex.HostIndex
         """
 
         self.inventory_generator = inventory_generator
-        self.ansible_inventory = ansible_inventory
+        self.host_index = host_index
         self.root_dir = root_dir
         self.cluster_config = cluster_config
         self.ops_config = ops_config
@@ -97,9 +97,9 @@ class SyncRunner(object):
             remote.pattern, stderr=True)
 
         remote_hosts = []
-        hosts = self.ansible_inventory.get_hosts(remote.pattern)
+        hosts = self.host_index.get_hosts(remote.pattern)
         if not hosts:
-            bastion = self.ansible_inventory.get_hosts(
+            bastion = self.host_index.get_hosts(
                 'bastion')[0].vars.get('ansible_ssh_host')
             remote_hosts.append('{}--{}'.format(bastion, remote.pattern))
         else:
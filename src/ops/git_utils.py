@@ -8,7 +8,6 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
-import git
 import logging
 import os
 import yaml
@@ -20,6 +19,9 @@ def setup_repo(repo_path, upstream_repo):
     """
     Ensure that the repo is present or clone it from upstream otherwise.
     """
+    # GitPython is only needed by the terraform and helmfile commands
+    import git
+
     repo_path = os.path.expanduser(repo_path)
 
     try:
@@ -32,6 +34,8 @@ def setup_repo(repo_path, upstream_repo):
 
 
 def checkout_repo(repo_path, config_path, get_version):
+    import git
+
     with open(os.path.expanduser(config_path)) as f:
         conf = yaml.load(f, Loader=yaml.SafeLoader)
 
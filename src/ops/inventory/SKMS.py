@@ -21,14 +21,15 @@ Copyright (c) 2013-2015 Adobe Systems Inc (TechOps AppDev)
 # - Python support for Requests
 # - Python support for JSON
 # @version v1.10, 2016-06-30
+import copy
 import socket
 import os
 import getpass
 import requests
 import inspect
-import urllib
 import json
 from os.path import expanduser
+from urllib.parse import quote
 
 
 class WebApiClient(object):
@@ -54,6 +55,7 @@ class WebApiClient(object):
     skms_session_storage_file = None
     skms_session_id = None
     status = False
+    throttler = None
     trusted_cert_file_path = None
     username = ''
     verify_ssl_chain = True
@@ -73,6 +75,9 @@ class WebApiClient(object):
         if skms_domain is not None:
             self.skms_domain = skms_domain
 
+        # One pooled session, so that consecutive requests reuse their connections
+        self.requests_obj = requests.Session()
+
         # Set Tracking Info
         filename = inspect.stack()[1][1]
         if filename is not None:
@@ -114,6 +119,18 @@ class WebApiClient(object):
     # ---------------------------#
     #    CONFIGURATION METHODS   #
     # ---------------------------#
+    def clone(self):
+        """Returns a client sharing the HTTP and SKMS sessions of this one,
+        to send requests from another thread"""
+        client = copy.copy(self)
+        client.error_message = ''
+        client.response_dict = None
+        client.response_header = ''
+        client.response_str = ''
+        # only the original client stores the session
+        client.skms_session_storage_file = None
+        return client
+
     def enable_debug_mode(self):
         """Enables debug mode which will return debug info"""
         self.debug = True
@@ -150,7 +167,7 @@ class WebApiClient(object):
                 if (
                     isinstance(session_info, dict) and
                     'skms_csrf_token' in session_info and
-                    isinstance(session_info['skms_csrf_token'], basestring) and
+                    isinstance(session_info['skms_csrf_token'], str) and
                     session_info['skms_csrf_token'].strip() != ""
                 ):
                     self.set_skms_csrf_token(session_info['skms_csrf_token'])
@@ -166,7 +183,7 @@ class WebApiClient(object):
     def set_skms_session_id(self, skms_session_id):
         """Set the SKMS session id"""
         if (
-            isinstance(skms_session_id, basestring) and
+            isinstance(skms_session_id, str) and
             skms_session_id.strip() != ""
         ):
             self.skms_session_id = skms_session_id
@@ -243,9 +260,6 @@ class WebApiClient(object):
         # Add CSRF token to param dictionary (if applicable)
         if self.skms_csrf_token is not None and self.skms_csrf_token.strip() != "":
             method_param_dict['csrf_token'] = self.skms_csrf_token
-        # Instantiate Requests Object
-        self.requests_obj = requests
-
         # Set Method Post, URL, Parameters, and Add Session Cookie
         # (if applicable)
         try:
@@ -261,25 +275,23 @@ class WebApiClient(object):
                 ):
                     cookie_name = 'dev_' + cookie_name
 
-                response = self.requests_obj.post(
+                response = self.post(
                     "https://" + self.skms_domain + "/web_api/",
                     data={'_parameters': json.dumps(method_param_dict)},
                     verify=self.verify_ssl_chain,
                     timeout=self.request_timeout,
                     cert=self.trusted_cert_file_path,
-                    cookies={cookie_name: urllib.quote(self.skms_session_id)}
+                    cookies={cookie_name: quote(self.skms_session_id)}
                 )
             else:
                 # Creating new session
-                response = self.requests_obj.post(
+                response = self.post(
                     "https://" + self.skms_domain + "/web_api/",
                     data={'_parameters': json.dumps(method_param_dict)},
                     verify=self.verify_ssl_chain,
                     timeout=self.request_timeout,
                     cert=self.trusted_cert_file_path
                 )
-            # triggers http exception if bad request (i.e. 404)
-            response.raise_for_status()
 
             # Separate header from body
             self.response_header = response.headers
@@ -370,6 +382,18 @@ class WebApiClient(object):
             self.status = False
             return self.status
 
+    def post(self, url, **kwargs):
+        """Posts the request, through the throttler if one is set"""
+        def post_and_check():
+            response = self.requests_obj.post(url, **kwargs)
+            # triggers http exception if bad request (i.e. 404)
+            response.raise_for_status()
+            return response
+
+        if self.throttler is None:
+            return post_and_check()
+        return self.throttler.call(post_and_check)
+
     def get_response_header(self):
         """Returns the response header of the last request"""
         return self.response_header
@@ -434,7 +458,7 @@ class WebApiClient(object):
         ):
             for message in response_dict['messages']:
                 if (
-                    isinstance(message_type, basestring) and
+                    isinstance(message_type, str) and
                     (message_type.strip() ==
                      "" or message['type'].lower() == message_type.lower())
                 ):
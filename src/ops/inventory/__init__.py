@@ -8,4 +8,11 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
-from .ec2inventory import Ec2Inventory
+
+def __getattr__(name):
+    # importing the package should not load boto3, Ec2Inventory is imported on first use
+    if name == 'Ec2Inventory':
+        from .ec2inventory import Ec2Inventory
+        return Ec2Inventory
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
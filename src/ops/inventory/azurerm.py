@@ -196,10 +196,12 @@ Version: 1.0.0
 
 import argparse
 from six.moves import configparser
+import copy
 import json
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from distutils.version import LooseVersion
 
@@ -246,6 +248,9 @@ AZURE_CONFIG_SETTINGS = dict(
 
 AZURE_MIN_VERSION = "0.30.0rc5"
 
+# instance views have no list call in the compute API we pin, they are fetched side by side
+POWERSTATE_CONCURRENCY = 8
+
 
 def azure_id_to_dict(id):
     pieces = re.sub(r'^\/', '', id).split('/')
@@ -292,6 +297,15 @@ class AzureRM(object):
             self.fail("Failed to authenticate with provided credentials. Some attributes were missing. "
                       "Credentials must include client_id, secret and tenant or ad_user and password.")
 
+    def for_subscription(self, subscription_id):
+        """ Returns an AzureRM of another subscription, sharing the credentials of this one """
+        rm = copy.copy(self)
+        rm.subscription_id = subscription_id
+        rm._compute_client = None
+        rm._resource_client = None
+        rm._network_client = None
+        return rm
+
     def log(self, msg):
         if self.debug:
             print(msg + u'\n')
@@ -433,6 +447,7 @@ class AzureInventory(object):
         self.group_by_security_group = True
         self.group_by_tag = True
         self.include_powerstate = True
+        self.concurrency = None
 
         self._inventory = dict(
             _meta=dict(
@@ -526,6 +541,28 @@ class AzureInventory(object):
                 self._load_machines(virtual_machines)
 
     def _load_machines(self, machines):
+        for host_vars in self._get_host_vars(machines):
+            self._add_host(host_vars)
+
+    def _get_host_vars(self, machines):
+        """ Returns the host vars of the machines, in order
+
+        The network interfaces and public IPs are fetched with list calls and joined
+        to the machines by resource ID, so the number of requests depends on the
+        number of pages and not on the number of machines
+        """
+
+        machines = list(machines)
+        network_interfaces = self._get_network_interfaces(
+            interface.id for machine in machines
+            for interface in machine.network_profile.network_interfaces)
+        public_ip_addresses = self._get_public_ip_addresses(
+            ip_config.public_ip_address.id
+            for network_interface in network_interfaces.values() if network_interface.primary
+            for ip_config in network_interface.ip_configurations if ip_config.public_ip_address)
+        powerstates = self._get_powerstates(machines) if self.include_powerstate else {}
+
+        result = []
         for machine in machines:
             id_dict = azure_id_to_dict(machine.id)
 
@@ -568,8 +605,7 @@ class AzureInventory(object):
             )
 
             if self.include_powerstate:
-                host_vars['powerstate'] = self._get_powerstate(
-                    resource_group, machine.name)
+                host_vars['powerstate'] = powerstates[machine.id.lower()]
 
             if machine.storage_profile.image_reference:
                 host_vars['image'] = dict(
@@ -594,10 +630,7 @@ class AzureInventory(object):
                                                                              certificate_url=listener.certificate_url))
 
             for interface in machine.network_profile.network_interfaces:
-                interface_reference = self._parse_ref_id(interface.id)
-                network_interface = self._network_client.network_interfaces.get(
-                    interface_reference['resourceGroups'],
-                    interface_reference['networkInterfaces'])
+                network_interface = network_interfaces[interface.id.lower()]
                 if network_interface.primary:
                     if self.group_by_security_group and \
                        self._security_groups[resource_group].get(network_interface.id, None):
@@ -612,11 +645,8 @@ class AzureInventory(object):
                         host_vars['private_ip'] = ip_config.private_ip_address
                         host_vars['private_ip_alloc_method'] = ip_config.private_ip_allocation_method
                         if ip_config.public_ip_address:
-                            public_ip_reference = self._parse_ref_id(
-                                ip_config.public_ip_address.id)
-                            public_ip_address = self._network_client.public_ip_addresses.get(
-                                public_ip_reference['resourceGroups'],
-                                public_ip_reference['publicIPAddresses'])
+                            public_ip_address = public_ip_addresses[
+                                ip_config.public_ip_address.id.lower()]
                             host_vars['ansible_host'] = public_ip_address.ip_address
                             host_vars['public_ip'] = public_ip_address.ip_address
                             host_vars['public_ip_name'] = public_ip_address.name
@@ -627,7 +657,55 @@ class AzureInventory(object):
                         else:
                             host_vars['ansible_host'] = ip_config.private_ip_address
 
-            self._add_host(host_vars)
+            result.append(host_vars)
+
+        return result
+
+    def _get_network_interfaces(self, ids):
+        """ Returns the network interfaces by lower case resource ID """
+        return self._get_resources(
+            ids, self._network_client.network_interfaces, 'networkInterfaces')
+
+    def _get_public_ip_addresses(self, ids):
+        """ Returns the public IP addresses by lower case resource ID """
+        return self._get_resources(
+            ids, self._network_client.public_ip_addresses, 'publicIPAddresses')
+
+    def _get_resources(self, ids, operations, resource_type):
+        """ Lists the resources of the resource groups the ids belong to, and gets the ones
+        not listed
+
+        Only those resource groups are listed, so a lookup narrowed to a few machines does not
+        page through every resource of the subscription.
+        """
+
+        ids = dict((resource_id.lower(), resource_id) for resource_id in ids)
+        if not ids:
+            return {}
+
+        resource_groups = dict((reference['resourceGroups'].lower(), reference['resourceGroups'])
+                               for reference in map(self._parse_ref_id, ids.values()))
+        listed = [resource for _, resource_group in sorted(resource_groups.items())
+                  for resource in operations.list(resource_group)]
+
+        resources = dict((resource.id.lower(), resource) for resource in listed)
+        for resource_id in sorted(set(ids) - set(resources)):
+            reference = self._parse_ref_id(ids[resource_id])
+            resources[resource_id] = operations.get(
+                reference['resourceGroups'], reference[resource_type])
+
+        return resources
+
+    def _get_powerstates(self, machines):
+        """ Returns the power state of the machines by lower case resource ID """
+        max_workers = self.concurrency or POWERSTATE_CONCURRENCY
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(machine.id.lower(), executor.submit(
+                self._get_powerstate, azure_id_to_dict(machine.id)['resourceGroups'],
+                machine.name))
+                for machine in machines]
+
+            return dict((machine_id, future.result()) for machine_id, future in futures)
 
     def _selected_machines(self, virtual_machines):
         selected_machines = []
@@ -709,7 +787,7 @@ class AzureInventory(object):
         if pretty:
             return json.dumps(self._inventory, sort_keys=True, indent=2)
         else:
-            return json.dumps(self._inventory)
+            return json.dumps(self._inventory, separators=(',', ':'))
 
     def _get_settings(self):
         # Load settings from the .ini, if it exists. Otherwise,
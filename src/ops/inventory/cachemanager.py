@@ -0,0 +1,160 @@
+# Copyright 2019 Adobe. All rights reserved.
+# This file is licensed to you under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+
+import logging
+import os
+import shutil
+import time
+
+from . import caching, sqliteindex
+
+logger = logging.getLogger(__name__)
+
+# prefix of the dirs created by InventoryGenerator.generate
+GENERATED_DIR_PREFIX = 'inventory'
+
+# prefix of the inventory cache entries, the plugin and script output caches have none
+CACHE_ENTRY_PREFIX = 'location-'
+
+# dirs younger than this are never removed, they may still be getting generated
+GRACE_PERIOD = 300
+
+SQLITE_INDEX = 'inventory.sqlite'
+
+
+class InventoryCacheManager(object):
+    """
+    Removes the generated inventory dirs under cache.dir that are no longer used
+
+    A dir is in use while a valid inventory cache entry points at it. The others
+    are removed once older than cache.gc.max_age, and then oldest first while all
+    the generated dirs together take more than cache.gc.max_size bytes, as long as
+    they are older than cache.gc.min_age: a command started from an uncached
+    inventory may still run against its dir.
+    """
+
+    def __init__(self, ops_config):
+        self.cache_dir = os.path.expanduser(ops_config.get('cache.dir'))
+        self.max_age = int(ops_config.get('cache.gc.max_age') or 0)
+        self.max_size = int(ops_config.get('cache.gc.max_size') or 0)
+        self.min_age = max(int(ops_config.get('cache.gc.min_age') or 0), GRACE_PERIOD)
+        self.interval = int(ops_config.get('cache.gc.interval') or 0)
+        # how long an inventory cache entry can be served, stale or not
+        self.entry_max_age = int(ops_config.get('inventory.max_age') or 0) + \
+            int(ops_config.get('inventory.stale_while_revalidate') or 0) + GRACE_PERIOD
+        self.stamp_path = os.path.join(self.cache_dir, '.gc')
+
+    def generated_dirs(self):
+        """ Returns the generated dirs and their modification time, oldest first """
+        if not os.path.isdir(self.cache_dir):
+            return []
+
+        dirs = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith(GENERATED_DIR_PREFIX) and entry.is_dir(follow_symlinks=False):
+                dirs.append((entry.path, entry.stat(follow_symlinks=False).st_mtime))
+
+        return sorted(dirs, key=lambda d: d[1])
+
+    def referenced_dirs(self):
+        """ Returns the generated dirs that valid inventory cache entries point at """
+        referenced = set()
+        for entry in os.scandir(self.cache_dir):
+            # skip lock files, the plugin and script output caches, which can be large,
+            # and the rest
+            if not entry.name.startswith(CACHE_ENTRY_PREFIX) or entry.name.endswith('.lock') or \
+                    not entry.is_file():
+                continue
+            if not caching.is_valid(entry.path, self.entry_max_age):
+                continue
+
+            try:
+                cache = caching.read(entry.path)
+            except Exception as e:
+                logger.debug("Skipping unreadable cache file %s: %s", entry.path, e)
+                continue
+
+            if isinstance(cache, dict) and cache.get('inventory_path'):
+                referenced.add(os.path.dirname(os.path.realpath(cache['inventory_path'])))
+
+        return referenced
+
+    def collect(self):
+        """ Removes the unused generated dirs, returns what was removed and what is left """
+        now = time.time()
+        dirs = self.generated_dirs()
+        referenced = self.referenced_dirs() if dirs else set()
+        unused = [(path, mtime) for path, mtime in dirs
+                  if os.path.realpath(path) not in referenced and now - mtime > GRACE_PERIOD]
+
+        removed = []
+        if self.max_age:
+            removed = [path for path, mtime in unused if now - mtime > self.max_age]
+
+        freed = 0
+        sizes = {}
+        if self.max_size:
+            sizes = dict((path, get_size(path)) for path, _ in dirs)
+            total = sum(sizes.values()) - sum(sizes[path] for path in removed)
+            for path, mtime in unused:
+                if total <= self.max_size or now - mtime <= self.min_age:
+                    break
+                if path not in removed:
+                    removed.append(path)
+                    total -= sizes[path]
+
+        for path in removed:
+            freed += sizes[path] if path in sizes else get_size(path)
+            shutil.rmtree(path, onerror=log_error)
+
+        self.unindex(removed)
+
+        return dict(dirs=len(dirs), removed=len(removed), kept=len(dirs) - len(removed),
+                    referenced=len(referenced), freed=freed)
+
+    def collect_if_due(self):
+        """ Runs collect() at most once per cache.gc.interval, across processes """
+        if not self.interval or caching.is_valid(self.stamp_path, self.interval):
+            return None
+
+        with caching.lock(self.stamp_path, blocking=False) as acquired:
+            # another process is already collecting
+            if not acquired or caching.is_valid(self.stamp_path, self.interval):
+                return None
+
+            with open(self.stamp_path, 'a'):
+                os.utime(self.stamp_path, None)
+
+            result = self.collect()
+            logger.info("Collected generated inventory dirs under %s: %s", self.cache_dir, result)
+            return result
+
+    def unindex(self, removed):
+        sqlite_path = os.path.join(self.cache_dir, SQLITE_INDEX)
+        if not removed or not os.path.isfile(sqlite_path):
+            return
+
+        sqliteindex.remove(sqlite_path, [os.path.join(path, 'inventory') for path in removed])
+
+
+def get_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+
+    return size
+
+
+def log_error(func, path, exc_info):
+    logger.warning("Cannot remove %s: %s", path, exc_info[1])
@@ -8,61 +8,219 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
+import fcntl
 import hashlib
 import json
+import mmap
 import os
+import tempfile
 import time
+import zlib
+from contextlib import contextmanager
 
 from six import PY3
 
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
 
-def cache_callback_result(directory, func, max_age, cache_key_args):
+# smaller files are read in one go, mapping them costs more than it saves
+MMAP_MIN_SIZE = 1024 * 1024
+
+
+class JsonSerializer(object):
+    """ Compact JSON, also what caches written by older versions contain """
+    name = 'json'
+
+    def dumps(self, data):
+        return json.dumps(data, separators=(',', ':'), default=list).encode('utf-8')
+
+    def loads(self, buf):
+        return json.loads(bytes(buf))
+
+    def detect(self, first_byte):
+        return first_byte < 0x80 and first_byte != 0x78
+
+
+class ZlibJsonSerializer(JsonSerializer):
+    """ Compact JSON compressed with zlib, best when the cache dir is on a slow disk """
+    name = 'json.zlib'
+
+    def dumps(self, data):
+        return zlib.compress(super(ZlibJsonSerializer, self).dumps(data), 1)
+
+    def loads(self, buf):
+        return json.loads(zlib.decompress(buf))
+
+    def detect(self, first_byte):
+        # zlib streams start with 0x78, which no JSON document does
+        return first_byte == 0x78
+
+
+class MsgpackSerializer(object):
+    """ msgpack, the fastest to read and write when the msgpack package is installed """
+    name = 'msgpack'
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=True, default=list)
+
+    def loads(self, buf):
+        if not HAS_MSGPACK:
+            raise Exception(
+                "The cache was written with msgpack but the msgpack package is not installed")
+        return msgpack.unpackb(buf, raw=False)
+
+    def detect(self, first_byte):
+        # maps, arrays and strings, which are all that caches hold, start at 0x80 or above
+        return first_byte >= 0x80
+
+
+SERIALIZERS = [JsonSerializer(), ZlibJsonSerializer(), MsgpackSerializer()]
+
+
+def get_serializer(name=None):
+    """ Returns the serializer configured by cache.format, 'auto' picks the fastest available """
+
+    if not name or name == 'auto':
+        name = 'msgpack' if HAS_MSGPACK else 'json.zlib'
+
+    for serializer in SERIALIZERS:
+        if serializer.name == name:
+            if serializer.name == 'msgpack' and not HAS_MSGPACK:
+                raise Exception("cache.format is msgpack but the msgpack package is not installed")
+            return serializer
+
+    raise Exception("Unknown cache.format %s, expected one of: auto, %s" %
+                    (name, ', '.join(serializer.name for serializer in SERIALIZERS)))
+
+
+def cache_callback_result(directory, func, max_age, cache_key_args, refresh=False,
+                          serializer=None):
     directory = os.path.expanduser(directory)
     path = get_cache_path(directory, cache_key_args)
-    if is_valid(path, max_age):
+    if not refresh and is_valid(path, max_age):
         return read(path)
 
-    return write(path, func())
+    # only one process computes the value, the others wait and reuse it
+    waiting_since = time.time()
+    with lock(path):
+        if is_valid(path, max_age) and (not refresh or is_newer(path, waiting_since)):
+            return read(path)
+
+        return write(path, func(), serializer)
+
 
+def is_newer(filename, timestamp):
+    """ Determines if the cache file was written after the given timestamp """
 
-def get_cache_path(dir, args):
+    age = get_age(filename)
+    return age is not None and age < time.time() - timestamp
+
+
+def get_cache_path(dir, args, prefix=''):
     m = hashlib.md5()
     json_dump = json.dumps(args)
     if PY3:
         json_dump = json_dump.encode('utf-8')
     m.update(json_dump)
 
-    return os.path.join(dir, m.hexdigest())
+    return os.path.join(dir, prefix + m.hexdigest())
 
 
 def is_valid(filename, max_age):
     """ Determines if the cache files have expired, or if it is still valid """
 
+    age = get_age(filename)
+    return age is not None and age < max_age
+
+
+def get_age(filename):
+    """ Returns the number of seconds since the cache file was written, or None if it does
+    not exist """
+
     filename = os.path.expanduser(filename)
     if os.path.isfile(filename):
-        mod_time = os.path.getmtime(filename)
-        current_time = time.time()
-        if (mod_time + max_age) > current_time:
-            return True
+        return time.time() - os.path.getmtime(filename)
+
+    return None
+
+
+@contextmanager
+def lock(filename, blocking=True):
+    """ Holds an exclusive lock on a cache file across processes
 
-    return False
+    Yields True once the lock is acquired, or False right away when blocking
+    is disabled and another process already holds it
+    """
 
+    lock_path = os.path.expanduser(filename) + '.lock'
+    ensure_dir(lock_path)
+    with open(lock_path, 'a') as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
 
-def write(filename, data):
-    """ Writes data in JSON format to a file """
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
 
-    json_data = json.dumps(data, sort_keys=True, indent=2)
-    cache = open(os.path.expanduser(filename), 'w')
-    cache.write(json_data)
-    cache.close()
+
+def ensure_dir(filename):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def write(filename, data, serializer=None):
+    """ Writes data to a file, in the format of the serializer (compact JSON by default)
+
+    The data is written to a temporary file in the same directory which is then
+    renamed over the cache file, so readers never see a partially written cache
+    """
+
+    filename = os.path.expanduser(filename)
+    ensure_dir(filename)
+    serialized = (serializer or SERIALIZERS[0]).dumps(data)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix='.' + os.path.basename(filename),
+        dir=os.path.dirname(filename) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as cache:
+            cache.write(serialized)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
 
     return data
 
 
 def read(filename):
-    """ Reads the inventory from the cache file and returns it as a JSON
-    object """
+    """ Reads a cache file written in any of the serializers formats
+
+    Large files are memory mapped, msgpack and zlib decode straight from the mapping
+    """
+
+    with open(os.path.expanduser(filename), 'rb') as cache:
+        size = os.fstat(cache.fileno()).st_size
+        if size < MMAP_MIN_SIZE:
+            return loads(cache.read())
+
+        with mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return loads(buf)
+
+
+def loads(buf):
+    if not len(buf):
+        raise ValueError("Empty cache file")
 
-    cache = open(os.path.expanduser(filename), 'r')
-    json_inventory = cache.read()
-    return json.loads(json_inventory)
+    first_byte = buf[0]
+    for serializer in SERIALIZERS:
+        if serializer.detect(first_byte):
+            return serializer.loads(buf)
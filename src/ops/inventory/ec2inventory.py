@@ -8,25 +8,123 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
+import copy
+import fnmatch
 import json
+import logging
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 
-import boto3
 from botocore.exceptions import NoRegionError, NoCredentialsError, PartialCredentialsError
 
+from ops import boto3pool
+from . import throttling
+from .orderedset import OrderedSet
+
+logger = logging.getLogger(__name__)
+
+RUNNING_FILTER = {'Name': 'instance-state-name', 'Values': ['running']}
+
+# nested instance attributes that are turned into host vars
+NESTED_HOST_INFO_KEYS = frozenset(['State', 'Placement', 'Tags', 'SecurityGroups'])
+
+# attributes add_instance needs whatever host vars are projected
+REQUIRED_INSTANCE_KEYS = frozenset(['InstanceId', 'PublicIpAddress', 'PrivateIpAddress'])
+
+UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9\-]")
+
+
+def compile_patterns(patterns):
+    """ Compiles a list of names or glob patterns into a single regex, None when there are none """
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+class HostVarsProjection(object):
+    """
+    Selects the ec2_* host vars that end up in the inventory
+
+    include and exclude are lists of host var names or glob patterns, like
+    ec2_tag_* or ec2_InstanceId. Without include every var is kept, exclude wins
+    over include. ansible_ssh_host, private_ip and private_ip_address are always set.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+        self._wanted = {}
+
+    @classmethod
+    def create(cls, config):
+        config = config or {}
+        return cls(config.get('include'), config.get('exclude'))
+
+    def wanted(self, name):
+        # the same few names come up for every instance
+        wanted = self._wanted.get(name)
+        if wanted is None:
+            wanted = self._wanted[name] = \
+                (self.include is None or bool(self.include.match(name))) and \
+                (self.exclude is None or not self.exclude.match(name))
+        return wanted
+
+
+class TagGrouping(object):
+    """
+    Decides which groups the tags of an instance go to
+
+    tags is a list of tag keys or glob patterns, all the tags by default. A group is
+    named after the tag value, or with a prefix (a format string of the tag key,
+    like tag_{key}_) after the prefix and the value made safe, eg. tag_role_web.
+    ip adds every host to a group named after its ansible_ssh_host.
+    """
+
+    def __init__(self, tags=None, prefix=None, ip=True):
+        self.tags = compile_patterns(tags)
+        self.prefix = prefix
+        self.ip = ip
+        self._prefixes = {}
+
+    @classmethod
+    def create(cls, config):
+        config = config or {}
+        return cls(config.get('tags'), config.get('prefix'), config.get('ip', True))
+
+    def get_prefix(self, key):
+        """ Returns the group name prefix of a tag key, None when the tag is not grouped """
+        if key not in self._prefixes:
+            if self.tags is not None and not self.tags.match(key):
+                self._prefixes[key] = None
+            else:
+                self._prefixes[key] = self.prefix.format(key=key) if self.prefix else ''
+        return self._prefixes[key]
+
+    def get_groups(self, tags):
+        for key, value in tags.items():
+            prefix = self.get_prefix(key)
+            if prefix is None or not value:
+                continue
+            yield UNSAFE_CHARS.sub('_', prefix + value) if prefix else value
+
 
 class Ec2Inventory(object):
     @staticmethod
     def _empty_inventory():
         return {"_meta": {"hostvars": {}}}
 
-    def __init__(self, boto_profile, regions, filters=None, bastion_filters=None):
+    def __init__(self, boto_profile, regions, filters=None, bastion_filters=None, concurrency=None,
+                 hostvars=None, groups=None):
 
         self.filters = filters or []
         self.regions = regions.split(',')
         self.boto_profile = boto_profile
         self.bastion_filters = bastion_filters or []
+        self.concurrency = concurrency
+        self.hostvars = HostVarsProjection.create(hostvars)
+        self.grouping = TagGrouping.create(groups)
         self.group_callbacks = []
         self.boto3_session = self.create_boto3_session(boto_profile)
 
@@ -40,7 +138,7 @@ class Ec2Inventory(object):
     def create_boto3_session(self, profile_name):
         try:
             # Use the profile to create a session
-            session = boto3.Session(profile_name=profile_name)
+            session = boto3pool.pool.session(profile_name)
 
             # Verify region
             if not self.regions:
@@ -58,7 +156,8 @@ class Ec2Inventory(object):
 
     def get_as_json(self):
         self.do_api_calls_update_cache()
-        return self.json_format_dict(self.inventory, True)
+        # parsed by Ansible, not read by people
+        return self.json_format_dict(self.inventory, False)
 
     def __str__(self):
         return self.get_as_json()
@@ -77,47 +176,162 @@ class Ec2Inventory(object):
         Find ips for the bastion box
         """
 
+        return self.get_bastion_ip(self.find_bastion_boxes(ec2_client))
+
+    def find_bastion_boxes(self, ec2_client):
+        """ Returns the running instances matching the bastion filters """
+
         if not self.bastion_filters:
-            return
+            return []
 
-        self.bastion_filters.append({'Name': 'instance-state-name', 'Values': ['running']})
+        bastion_filters = self.to_filter_list(self.bastion_filters) + [RUNNING_FILTER]
 
-        reservations = ec2_client.describe_instances(Filters=self.bastion_filters)['Reservations']
-        for reservation in reservations:
-            for instance in reservation['Instances']:
-                return instance['PublicIpAddress']
+        return [self.compact_instance(instance)
+                for page in self.describe_instances(ec2_client, bastion_filters)
+                for reservation in page['Reservations']
+                for instance in reservation['Instances']]
+
+    @staticmethod
+    def get_bastion_ip(bastions):
+        for bastion in bastions:
+            return bastion['PublicIpAddress']
 
     def do_api_calls_update_cache(self):
         """ Do API calls to each region, and save data in cache files """
 
-        for region in self.regions:
-            self.get_instances_by_region(region)
+        for region, bastions, instances in self.fetch_regions():
+            bastion_ip = self.get_bastion_ip(bastions)
+            for instance in instances:
+                self.add_instance(bastion_ip, instance, region)
+
+    def get_partitioned(self, tag_key):
+        """ Builds one inventory per value of the tag_key tag from a single round of API calls
+
+        Each partition has its own bastion and host name index, so the result is
+        the same as querying every tag value on its own
+        """
+
+        partitions = {}
+        for region, bastions, instances in self.fetch_regions():
+            bastion_ips = {}
+            for bastion in bastions:
+                bastion_ips.setdefault(self.get_tag(bastion, tag_key), bastion['PublicIpAddress'])
+
+            for instance in instances:
+                value = self.get_tag(instance, tag_key)
+                partition = partitions.get(value)
+                if partition is None:
+                    partition = partitions[value] = copy.copy(self)
+                    partition.inventory = self._empty_inventory()
+                    partition.index = {}
+                partition.add_instance(bastion_ips.get(value), instance, region)
+
+        return partitions
+
+    def fetch_regions(self):
+        """ Fetches the instances and the bastions of all the regions concurrently
+
+        Results are returned in the regions order, so that adding them to the
+        inventory (and the host name deduplication) does not depend on timing
+        """
+
+        clients = [(region, self.get_ec2_client(region)) for region in self.regions]
+        max_workers = self.concurrency or 2 * len(clients)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetches = [(region,
+                        executor.submit(self.get_instances, ec2_client),
+                        executor.submit(self.find_bastion_boxes, ec2_client))
+                       for region, ec2_client in clients]
+
+            results = [(region, bastions.result(), instances.result())
+                       for region, instances, bastions in fetches]
+
+        logger.debug("boto3 pool stats: %s", boto3pool.pool.stats())
+        return results
+
+    def get_ec2_client(self, region):
+        return boto3pool.pool.client('ec2', self.boto_profile, region)
 
     def get_instances_by_region(self, region):
         """Makes an AWS EC2 API call to the list of instances in a particular
         region
         """
-        ec2_client = self.boto3_session.client('ec2', region_name=region)
-
-        reservations = ec2_client.describe_instances(Filters=self.filters)['Reservations']
+        ec2_client = self.get_ec2_client(region)
 
         bastion_ip = self.find_bastion_box(ec2_client)
+        for instance in self.get_instances(ec2_client):
+            self.add_instance(bastion_ip, instance, region)
+
+    def get_instances(self, ec2_client):
+        """ Returns the running instances matching the filters, sorted by name and id
+
+        Pages are processed as they arrive and only the instance attributes that
+        end up in the inventory are kept, so large accounts are not held in
+        memory in full until sorting
+        """
+
+        filters = self.to_filter_list(self.filters) + [RUNNING_FILTER]
+
         instances = []
-        for reservation in reservations:
-            instances.extend(reservation['Instances'])
+        for page in self.describe_instances(ec2_client, filters):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instances.append((self.sort_key(instance), self.compact_instance(instance)))
 
-        # sort the instance based on name and index, in this order
-        def sort_key(instance):
-            name = next((tag['Value'] for tag in instance.get('Tags', [])
-                         if tag['Key'] == 'Name'), '')
-            return "{}-{}".format(name, instance['InstanceId'])
+        instances.sort(key=itemgetter(0))
+        return [instance for _, instance in instances]
 
-        for instance in sorted(instances, key=sort_key):
-            self.add_instance(bastion_ip, instance, region)
+    @staticmethod
+    def describe_instances(ec2_client, filters):
+        """ Yields the describe_instances pages, each page request takes a token from the
+        ec2 throttler
+
+        Retries happen in the client (botocore adaptive mode), they are only counted here
+        """
+
+        throttler = throttling.get('ec2')
+        pages = iter(ec2_client.get_paginator('describe_instances').paginate(Filters=filters))
+        while True:
+            throttler.acquire()
+            page = next(pages, None)
+            if page is None:
+                return
+            throttler.record_retries(page.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+            yield page
+
+    @staticmethod
+    def sort_key(instance):
+        """ Sort the instances based on name and index, in this order """
+        name = next((tag['Value'] for tag in instance.get('Tags', [])
+                     if tag['Key'] == 'Name'), '')
+        return "{}-{}".format(name, instance['InstanceId'])
+
+    @staticmethod
+    def get_tag(instance, key):
+        return next((tag['Value'] for tag in instance.get('Tags', [])
+                     if tag['Key'] == key), None)
+
+    def compact_instance(self, instance):
+        """ Drops the attributes that get_host_info_dict_from_instance ignores or does not
+        project """
+        return {key: value for key, value in instance.items()
+                if key in NESTED_HOST_INFO_KEYS or key in REQUIRED_INSTANCE_KEYS or
+                ((value is None or isinstance(value, (int, bool, str))) and
+                 self.hostvars.wanted(self.to_safe('ec2_' + key)))}
+
+    @staticmethod
+    def to_filter_list(filters):
+        """ Accepts filters both as a boto3 list and as a {name: value(s)} dict """
+        if not isinstance(filters, dict):
+            return list(filters)
+
+        return [{'Name': name, 'Values': values if isinstance(values, list) else [values]}
+                for name, values in filters.items()]
 
     def get_instance(self, region, instance_id):
         """ Gets details about a specific instance """
-        ec2_client = self.boto3_session.client('ec2', region_name=region)
+        ec2_client = self.get_ec2_client(region)
         # connect_to_region will fail "silently" by returning None if the
         # region name is wrong or not supported
         if ec2_client is None:
@@ -140,8 +354,10 @@ class Ec2Inventory(object):
         if instance['State']['Name'] != 'running':
             return
 
+        tags = dict((tag['Key'], tag['Value']) for tag in instance.get('Tags', []))
+
         # Use the instance name instead of the public ip
-        dest = next((tag['Value'] for tag in instance.get('Tags', []) if tag['Key'] == 'Name'), instance.get('PublicIpAddress'))
+        dest = tags['Name'] if 'Name' in tags else instance.get('PublicIpAddress')
         if not dest:
             return
 
@@ -166,16 +382,16 @@ class Ec2Inventory(object):
                 if group:
                     self.push(self.inventory, group, dest)
 
-        # Group by all tags
-        for tag in instance.get('Tags', []):
-            if tag['Value']:
-                self.push(self.inventory, tag['Value'], dest)
+        # Group by the tags
+        for group in self.grouping.get_groups(tags):
+            self.push(self.inventory, group, dest)
 
         # Inventory: Group by region
         self.push(self.inventory, region, dest)
 
         # Put the ip in a group just to find it in the ssh connection
-        self.push(self.inventory, ansible_ssh_host, dest)
+        if self.grouping.ip:
+            self.push(self.inventory, ansible_ssh_host, dest)
 
         # Inventory: Group by availability zone
         self.push(self.inventory, instance['Placement']['AvailabilityZone'], dest)
@@ -184,30 +400,39 @@ class Ec2Inventory(object):
         self.inventory["_meta"]["hostvars"][dest]['ansible_ssh_host'] = ansible_ssh_host
 
     def get_host_info_dict_from_instance(self, instance):
+        wanted = self.hostvars.wanted
         instance_vars = {}
         for key, value in instance.items():
-            safe_key = self.to_safe('ec2_' + key)
-
             if key == 'State':
-                instance_vars['ec2_state'] = value['Name']
-                instance_vars['ec2_state_code'] = value['Code']
-            elif isinstance(value, (int, bool)):
-                instance_vars[safe_key] = value
-            elif isinstance(value, str):
-                instance_vars[safe_key] = value.strip()
-            elif value is None:
-                instance_vars[safe_key] = ''
+                if wanted('ec2_state'):
+                    instance_vars['ec2_state'] = value['Name']
+                if wanted('ec2_state_code'):
+                    instance_vars['ec2_state_code'] = value['Code']
             elif key == 'Placement':
-                instance_vars['ec2_placement'] = value['AvailabilityZone']
+                if wanted('ec2_placement'):
+                    instance_vars['ec2_placement'] = value['AvailabilityZone']
             elif key == 'Tags':
                 for tag in value:
                     tag_key = self.to_safe('ec2_tag_' + tag['Key'])
-                    instance_vars[tag_key] = tag['Value']
+                    if wanted(tag_key):
+                        instance_vars[tag_key] = tag['Value']
             elif key == 'SecurityGroups':
-                group_ids = [group['GroupId'] for group in value]
-                group_names = [group['GroupName'] for group in value]
-                instance_vars["ec2_security_group_ids"] = ','.join(group_ids)
-                instance_vars["ec2_security_group_names"] = ','.join(group_names)
+                if wanted('ec2_security_group_ids'):
+                    instance_vars["ec2_security_group_ids"] = ','.join(
+                        group['GroupId'] for group in value)
+                if wanted('ec2_security_group_names'):
+                    instance_vars["ec2_security_group_names"] = ','.join(
+                        group['GroupName'] for group in value)
+            else:
+                safe_key = self.to_safe('ec2_' + key)
+                if not wanted(safe_key):
+                    continue
+                if isinstance(value, (int, bool)):
+                    instance_vars[safe_key] = value
+                elif isinstance(value, str):
+                    instance_vars[safe_key] = value.strip()
+                elif value is None:
+                    instance_vars[safe_key] = ''
 
         instance_vars['private_ip'] = instance.get('PrivateIpAddress', '')
         instance_vars['private_ip_address'] = instance.get('PrivateIpAddress', '')
@@ -239,30 +464,25 @@ class Ec2Inventory(object):
         """
         if key == element:
             return
-        group_info = my_dict.setdefault(key, [])
+        group_info = my_dict.setdefault(key, OrderedSet())
         if isinstance(group_info, dict):
-            host_list = group_info.setdefault('hosts', [])
-            if element not in host_list:
-                host_list.append(element)
+            group_info.setdefault('hosts', OrderedSet()).add(element)
         else:
-            if element not in group_info:
-                group_info.append(element)
+            group_info.add(element)
 
     def push_group(self, my_dict, key, element):
         """ Push a group as a child of another group. """
         parent_group = my_dict.setdefault(key, {})
         if not isinstance(parent_group, dict):
             parent_group = my_dict[key] = {'hosts': parent_group}
-        child_groups = parent_group.setdefault('children', [])
-        if element not in child_groups:
-            child_groups.append(element)
+        parent_group.setdefault('children', OrderedSet()).add(element)
 
     def to_safe(self, word):
         """ Converts 'bad' characters in a string to underscores so they can be
         used as Ansible groups
         """
 
-        return re.sub(r"[^A-Za-z0-9\-]", "_", word)
+        return UNSAFE_CHARS.sub("_", word)
 
     def json_format_dict(self, data, pretty=True):
         """ Converts a dict to a JSON object and dumps it as a formatted
@@ -270,8 +490,8 @@ class Ec2Inventory(object):
         """
 
         if pretty:
-            return json.dumps(data, sort_keys=True, indent=2)
-        return json.dumps(data)
+            return json.dumps(data, sort_keys=True, indent=2, default=list)
+        return json.dumps(data, separators=(',', ':'), default=list)
 
     def group_by_tag(self, param):
         self.group(lambda instance: [instance.tags.get(param, 'no-' + param)])
@@ -8,19 +8,21 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
+import errno
+import itertools
+import json
 import os
+import shutil
+import subprocess
 import tempfile
-import uuid
-from distutils.dir_util import copy_tree
-
-import ansible.inventory as ansible_inventory
-import ansible.vars as ansible_vars
-from . import caching
-from ansible.inventory.manager import InventoryManager
-from ansible.parsing.dataloader import DataLoader
-from ansible.playbook.play import display
-from ansible.vars.manager import VariableManager
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import caching, hostindex, sqliteindex, throttling
+from .cachemanager import CACHE_ENTRY_PREFIX, InventoryCacheManager
 from ops import OpsException
+from ops.cli import display
 import logging
 
 
@@ -33,8 +35,9 @@ class CachedInventoryGenerator(object):
         self.ops_config = ops_config
         self.cluster_config = cluster_config
         self.cache_location = self.location()
+        self.serializer = caching.get_serializer(ops_config.get('cache.format'))
 
-    def _get_cache(self):
+    def _get_cache(self, allow_stale=False):
         if 'REFRESH_CACHE' in os.environ:
             if os.environ['REFRESH_CACHE'] == 'True':
                 return False
@@ -43,31 +46,82 @@ class CachedInventoryGenerator(object):
             logger.info("Inventory caching disabled")
             return False
 
-        max_age = self.ops_config.get('inventory.max_age')
+        max_age = int(self.ops_config.get('inventory.max_age'))
         logger.info(
             "Checking cache from max_age=%s, location=%s" %
             (max_age, self.cache_location))
-        if caching.is_valid(self.cache_location, int(max_age)):
+        if caching.is_valid(self.cache_location, max_age):
             res = caching.read(self.cache_location)
-            display.display(
+            display(
                 "Loading cached inventory info from: %s" %
                 (self.cache_location), color='blue', stderr=True)
             return res
 
+        # within the grace window the stale entry is served right away and
+        # the inventory is rebuilt by a detached process
+        stale_window = int(self.ops_config.get('inventory.stale_while_revalidate') or 0)
+        if allow_stale and stale_window and \
+                caching.is_valid(self.cache_location, max_age + stale_window):
+            res = caching.read(self.cache_location)
+            display(
+                "Loading stale inventory info from: %s, refreshing it in the background" %
+                (self.cache_location), color='blue', stderr=True)
+            self._refresh_in_background()
+            return res
+
         return False
 
+    def _refresh_in_background(self):
+        """ Rebuilds the inventory in a detached process that outlives the current command """
+        try:
+            pid = os.fork()
+        except (AttributeError, OSError) as e:
+            logger.warning("Cannot refresh the inventory in the background: %s", e)
+            return
+
+        if pid:
+            # reap the intermediate child, the grandchild gets re-parented to init
+            os.waitpid(pid, 0)
+            return
+
+        try:
+            os.setsid()
+            if os.fork():
+                os._exit(0)
+
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+
+            with caching.lock(self.cache_location, blocking=False) as acquired:
+                # another process is already rebuilding this inventory
+                if not acquired:
+                    os._exit(0)
+
+                inventory_path, ssh_config_path = self.inventory_generator.generate()
+                self._save_cache(
+                    inventory_path, ssh_config_path, self.inventory_generator.errors)
+        finally:
+            os._exit(0)
+
     def _save_cache(self, inventory_path, ssh_config_path, errors):
         max_age = self.ops_config.get('inventory.max_age')
         if not max_age:
             return inventory_path, ssh_config_path
 
-        display.display("Caching inventory location to %s for %d seconds" % (self.cache_location, max_age),
-                        color='blue', stderr=True)
-        caching.write(self.cache_location, dict(
+        display("Caching inventory location to %s for %d seconds" % (self.cache_location, max_age),
+                color='blue', stderr=True)
+        cache = dict(
             inventory_path=inventory_path,
             ssh_config_path=ssh_config_path,
             errors=errors
-        ))
+        )
+        caching.write(self.cache_location, cache, self.serializer)
+
+        # the collector of the generated dirs only reads the cache entries under cache.dir
+        reference_location = self.reference_location()
+        if reference_location:
+            caching.write(reference_location, cache, self.serializer)
 
         return inventory_path, ssh_config_path
 
@@ -75,38 +129,64 @@ class CachedInventoryGenerator(object):
         settings = self.cluster_config.get('inventory_settings', {})
         default_cache_dir = self.ops_config.get('cache.dir')
         return settings.get('location', caching.get_cache_path(
-            default_cache_dir, self.cluster_config['inventory']))
+            default_cache_dir, self.cluster_config['inventory'], prefix=CACHE_ENTRY_PREFIX))
+
+    def reference_location(self):
+        """ The copy under cache.dir of an entry at a custom location, None otherwise """
+        settings = self.cluster_config.get('inventory_settings', {})
+        if 'location' not in settings:
+            return None
+
+        location = os.path.abspath(os.path.expanduser(settings['location']))
+        return caching.get_cache_path(self.ops_config.get('cache.dir'), dict(location=location),
+                                      prefix=CACHE_ENTRY_PREFIX)
 
     def clear_cache(self):
         # Note: This function is not used when --refresh-cache is passed
         cache = self._get_cache()
         if cache:
-            display.display(
+            display(
                 "Removing inventory cache %s" %
                 self.cache_location,
                 stderr=True,
                 color='green')
             try:
                 os.remove(os.path.expanduser(self.cache_location))
-                display.display("Success", color='blue')
+                display("Success", color='blue')
             except OSError:
-                display.display(
+                display(
                     "Warning, could not delete cache as it is not there.",
                     color='yellow')
 
     def generate(self):
-        cache = self._get_cache()
+        cache = self._get_cache(allow_stale=True)
         if cache:
-            inventory_path, ssh_config_path, errors = cache[
-                'inventory_path'], cache['ssh_config_path'], cache['errors']
-            self.inventory_generator.display_errors(errors)
+            return self._from_cache(cache)
 
-            return inventory_path, ssh_config_path
+        if not self.ops_config.get('inventory.max_age'):
+            return self.inventory_generator.generate()
+
+        waiting_since = time.time()
+        with caching.lock(self.cache_location):
+            # concurrent runs for the same cluster wait for the one that
+            # rebuilds the inventory and then reuse its result
+            if caching.is_newer(self.cache_location, waiting_since):
+                display(
+                    "Loading inventory info rebuilt by another process from: %s" %
+                    (self.cache_location), color='blue', stderr=True)
+                return self._from_cache(caching.read(self.cache_location))
 
-        inventory_path, ssh_config_path = self.inventory_generator.generate()
+            inventory_path, ssh_config_path = self.inventory_generator.generate()
 
-        return self._save_cache(
-            inventory_path, ssh_config_path, self.inventory_generator.errors)
+            return self._save_cache(
+                inventory_path, ssh_config_path, self.inventory_generator.errors)
+
+    def _from_cache(self, cache):
+        inventory_path, ssh_config_path, errors = cache[
+            'inventory_path'], cache['ssh_config_path'], cache['errors']
+        self.inventory_generator.display_errors(errors)
+
+        return inventory_path, ssh_config_path
 
 
 class InventoryGenerator(object):
@@ -116,6 +196,8 @@ class InventoryGenerator(object):
         self.cluster_config = cluster_config
         self.generators = inventory_generators
         self.cache_dir = ops_config.get('cache.dir')
+        self.concurrency = int(ops_config.get('inventory.concurrency') or 1)
+        self.ops_config = ops_config
 
         self.generated_path = None
         self.ssh_config_path = {}
@@ -133,7 +215,7 @@ class InventoryGenerator(object):
         inventory_path = base_path + '/inventory'
         os.mkdir(inventory_path)
 
-        display.display(
+        display(
             "Generating inventory to %s" %
             inventory_path,
             color='yellow',
@@ -144,123 +226,313 @@ class InventoryGenerator(object):
                 "No inventory entry found in configuration for " +
                 self.cluster_config.get('cluster', 'None'))
 
-        errors = []
         inventory_settings = self.cluster_config.get('inventory', {})
 
         if not isinstance(inventory_settings, list):
             raise OpsException(
                 "Inventory settings must be a list of dict entries")
 
-        for entry in inventory_settings:
-            found_generator = False
-
-            for generator in self.generators:
-                if generator.supports(entry):
-                    try:
-                        generator.generate(inventory_path, entry)
-                    except KeyError as e:
-                        error = 'Required key %s not found' % e
-                        errors.append(dict(entry=entry, error=error))
-                    found_generator = True
-                    break
-
-            if not found_generator:
-                raise Exception(
-                    "Cannot find generator for inventory entry %s" %
-                    entry)
+        # network bound entries run on a thread pool, the rest run in order;
+        # errors are collected by entry position so the output stays stable
+        errors = [None] * len(inventory_settings)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for index, entry in enumerate(inventory_settings):
+                generator = self.get_generator(entry)
+                if getattr(generator, 'concurrent', False):
+                    futures[index] = executor.submit(
+                        self.generate_entry, generator, inventory_path, entry, index)
+                else:
+                    errors[index] = self.generate_entry(
+                        generator, inventory_path, entry, index)
+
+        for index, future in futures.items():
+            errors[index] = future.result()
+        errors = [error for error in errors if error]
 
         self.ssh_config_path = self.ssh_config_generator.generate(base_path)
         self.generated_path = inventory_path
         self.errors = errors
 
+        self.index_inventory(inventory_path)
+
         self.display_errors(errors)
+        self.display_throttling()
+        self.collect_garbage()
 
         return self.generated_path, self.ssh_config_path
 
+    def get_generator(self, entry):
+        for generator in self.generators:
+            if generator.supports(entry):
+                return generator
+
+        raise Exception(
+            "Cannot find generator for inventory entry %s" %
+            entry)
+
+    @staticmethod
+    def generate_entry(generator, inventory_path, entry, index):
+        try:
+            generator.generate(inventory_path, entry, index)
+        except KeyError as e:
+            error = 'Required key %s not found' % e
+            return dict(entry=entry, error=error)
+
+    def index_inventory(self, inventory_path):
+        """ Writes the host index of the new inventory, so that ssh and sync do not load it
+        in Ansible, and adds it to the SQLite index when enabled """
+        # the Ansible inventory is only loaded when something is generated
+        from ansible.inventory.manager import InventoryManager
+        from ansible.parsing.dataloader import DataLoader
+
+        try:
+            inventory = InventoryManager(loader=DataLoader(), sources=[inventory_path])
+            data = hostindex.build(inventory)
+            caching.write(hostindex.get_index_path(inventory_path), data,
+                          caching.get_serializer(self.ops_config.get('cache.format')))
+            if not self.ops_config.get('inventory.sqlite_index'):
+                return
+
+            inventory_key = "%s-%s" % (self.cluster_config.get('cluster'), os.path.basename(
+                caching.get_cache_path('', self.cluster_config['inventory'])))
+            sqliteindex.update(hostindex.get_sqlite_path(self.ops_config), inventory_key,
+                               inventory_path, data)
+        except Exception as e:
+            logger.warning("Cannot index the inventory %s: %s", inventory_path, e)
+
+    def collect_garbage(self):
+        """ Every generated inventory gets its own dir, remove the ones no cache uses anymore """
+        try:
+            InventoryCacheManager(self.ops_config).collect_if_due()
+        except Exception as e:
+            logger.warning("Cannot remove the unused inventory dirs from %s: %s",
+                           self.cache_dir, e)
+
     @staticmethod
     def display_errors(errors):
         for error in errors:
-            display.display(
+            display(
                 "%s for entry %s" %
                 (error['error'],
                  error['entry']),
                 stderr=True,
                 color='yellow')
 
+    @staticmethod
+    def display_throttling():
+        # helps tuning inventory.concurrency and the inventory.throttling limits
+        for line in throttling.report():
+            display(
+                "Inventory API calls throttled - %s" % line,
+                stderr=True,
+                color='yellow')
+
 
 class DirInventoryGenerator(object):
-    """ Just copies the full path specified in path into the inventory dir """
+    """
+    Adds the files of the directory entry to the inventory dir
 
-    def __init__(self, root_dir):
+    The directories are recreated and the files are symlinked (or hardlinked) by
+    default, so it costs one metadata operation per file whatever their size.
+    Entries of several directories are merged, a later entry wins for the same
+    file. The mode is set by inventory.directory_link or per entry with `link`:
+    symlink, hardlink or copy. Hardlinks fall back to copies across filesystems.
+    """
+
+    LINK_MODES = ('symlink', 'hardlink', 'copy')
+
+    def __init__(self, root_dir, ops_config):
         self.root_dir = root_dir
+        self.link_mode = ops_config.get('inventory.directory_link') or 'symlink'
 
     def supports(self, config):
         return config.get('directory') is not None
 
-    def generate(self, dest, config):
-        copy_tree(self.root_dir + '/' + config['directory'], dest)
+    def generate(self, dest, config, index=0):
+        source = os.path.join(self.root_dir, config['directory'])
+        link_mode = config.get('link', self.link_mode)
+        if link_mode not in self.LINK_MODES:
+            raise OpsException(
+                "Unknown link mode %s for inventory directory %s, expected one of: %s" %
+                (link_mode, config['directory'], ', '.join(self.LINK_MODES)))
+        if not os.path.isdir(source):
+            raise OpsException("Inventory directory %s does not exist" % source)
+
+        # symlinked subdirs, like a group_vars shared between clusters, are merged like the others
+        for root, dirs, files in os.walk(source, followlinks=True):
+            target_dir = os.path.join(dest, os.path.relpath(root, source))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in files:
+                self.link(os.path.join(root, name), os.path.join(target_dir, name), link_mode)
+
+    @staticmethod
+    def link(source, target, link_mode):
+        # a file linked by an earlier entry is replaced, copying onto it would write to its source
+        remove_link(target)
+
+        if link_mode == 'symlink':
+            os.symlink(os.path.abspath(source), target)
+            return
+        if link_mode == 'copy':
+            shutil.copy2(source, target)
+            return
+
+        try:
+            os.link(source, target)
+        except OSError as e:
+            # hardlinks cannot cross filesystems, nor be created on some of them
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copy2(source, target)
 
 
 class PluginInventoryGenerator(object):
-    template = """#!/usr/bin/env python
-# CONFIG: {config}
-# PLUGIN PATH: {plugin_path}
-print(\"\"\"
-{json_content}
-\"\"\")
-"""
-
-    def __init__(self, cluster_name, inventory_plugins):
+    # plugins are network bound and only write their own file
+    concurrent = True
+
+    def __init__(self, cluster_name, inventory_plugins, ops_config):
         self.cluster_name = cluster_name
         self.inventory_plugins = inventory_plugins
+        self.cache_dir = ops_config.get('cache.dir')
+        self.serializer = caching.get_serializer(ops_config.get('cache.format'))
+        self.ops_config = ops_config
+        self._throttling_configured = False
+        self._lock = threading.Lock()
 
     def supports(self, config):
         return config.get('plugin') is not None
 
-    def generate(self, dest, config):
+    def generate(self, dest, config, index=0):
+        self.configure_throttling()
         plugins = {
             plugin.__name__: plugin for plugin in self.inventory_plugins}
         plugin = plugins[config.get('plugin')]
 
-        inventory_json = plugin(config.get('args', {}))
+        output = self.get_plugin_output(plugin, config)
+        if isinstance(output, (str, bytes)):
+            output = json.loads(output)
+
+        # a static file is loaded by the Ansible yaml inventory plugin in process,
+        # Ansible reads the inventory dir in name order, so follow the entries order
+        inventory_dest = "%s/%s-%03d.json" % (dest, self.cluster_name, index)
+        logger.debug("Writing %s inventory entry %s to %s",
+                     plugin.__module__, config, inventory_dest)
+
+        write_static_inventory(inventory_dest, output)
+
+    def configure_throttling(self):
+        """ Sets up the throttlers on the first plugin entry, this loads botocore """
+        with self._lock:
+            if not self._throttling_configured:
+                throttling.configure(self.ops_config)
+                self._throttling_configured = True
+
+    def get_plugin_output(self, plugin, config):
+        """ Runs the plugin, or reuses its output when the entry has its own max_age """
+        args = config.get('args', {})
+        max_age = config.get('max_age')
+        if not max_age:
+            return plugin(args)
 
-        script_content = self.template.format(
-            config=repr(config),
-            plugin_path=plugin.__module__,
-            json_content=inventory_json
-        )
-        script_dest = "%s/%s-%s.sh" % (dest, self.cluster_name, uuid.uuid4())
+        logger.info("Using cache for %s inventory entry with max_age=%s",
+                    config['plugin'], max_age)
+        return caching.cache_callback_result(
+            self.cache_dir,
+            lambda: plugin(args),
+            int(max_age),
+            dict(plugin=config['plugin'], args=args),
+            refresh=os.environ.get('REFRESH_CACHE') == 'True',
+            serializer=self.serializer)
 
-        with open(script_dest, 'w+') as f:
-            f.write(script_content)
-            os.fchmod(f.fileno(), 0o500)
 
+def write_static_inventory(inventory_dest, inventory):
+    remove_link(inventory_dest)
+    if has_host_patterns(inventory):
+        write_inventory_script(inventory_dest, inventory)
+        return
 
-class ShellInventoryGenerator(object):
-    """
-    Creates a script to be executed by Ansible inventory mechanism and places it in
-    the temp directory
+    with open(inventory_dest, 'w') as f:
+        json.dump(to_static_inventory(inventory), f, separators=(',', ':'))
+        os.fchmod(f.fileno(), 0o400)
+
+
+def has_host_patterns(inventory):
+    """ Whether the yaml inventory plugin would parse some host names, as ranges like host[1:2]
+    or as host:port """
+    hostvars = inventory.get('_meta', {}).get('hostvars', {})
+    hosts = [host for name, group in inventory.items() if name != '_meta'
+             for host in ((group.get('hosts') or []) if isinstance(group, dict) else group)]
+
+    return any('[' in host or ':' in host for host in itertools.chain(hosts, hostvars))
+
+
+def write_inventory_script(inventory_dest, inventory):
+    """ Writes the inventory as a script printing it, Ansible's script plugin takes the host
+    names as they are """
+    script_dest = os.path.splitext(inventory_dest)[0] + '.sh'
+    remove_link(script_dest)
+
+    inventory = dict(inventory)
+    inventory.setdefault('_meta', {'hostvars': {}})
+    with open(script_dest, 'w') as f:
+        f.write("#!/bin/sh\ncat <<'OPS_INVENTORY'\n%s\nOPS_INVENTORY\n" %
+                json.dumps(inventory, separators=(',', ':')))
+        os.fchmod(f.fileno(), 0o500)
+
+
+def remove_link(path):
+    """ Files linked by a directory entry are replaced, never written through to their source """
+    if os.path.lexists(path):
+        os.unlink(path)
+
+
+def to_static_inventory(inventory):
+    """ Converts an inventory script output to the format of the Ansible yaml inventory plugin
+
+    Script groups are either a list of hosts or a dict with hosts, vars and children lists,
+    and the host vars are under _meta. Static groups map hosts and children to their
+    vars, so each host gets its vars where it first appears.
     """
 
-    template = """#!/bin/bash
+    hostvars = inventory.get('_meta', {}).get('hostvars', {})
+    seen = set()
+    groups = {}
+    for name, group in inventory.items():
+        if name == '_meta':
+            continue
+        if not isinstance(group, dict):
+            group = dict(hosts=group)
+
+        static_group = {}
+        hosts = {}
+        for host in group.get('hosts') or []:
+            hosts[host] = None if host in seen else hostvars.get(host)
+            seen.add(host)
+        if hosts:
+            static_group['hosts'] = hosts
+        if group.get('vars'):
+            static_group['vars'] = group['vars']
+        if group.get('children'):
+            static_group['children'] = dict.fromkeys(group['children'])
+        groups[name] = static_group
+
+    # an empty document is not a valid yaml inventory, Ansible would parse it as ini
+    return groups or {'all': {}}
 
-# Store the script inventory output in the cache directory for caching
-CURRENT_DIR="$( cd "$( dirname "${{BASH_SOURCE[0]}}" )" && pwd )"
-INVENTORY_CACHE="${{CURRENT_DIR}}/.inventory_cache"
 
-cd {root_dir}
-if [ -f "$INVENTORY_CACHE" ]; then
-  cat "$INVENTORY_CACHE"
-else
-  {script} | tee "$INVENTORY_CACHE"
-  if [ ${{PIPESTATUS[0]}} -ne 0 ]; then
-    rm "$INVENTORY_CACHE"
-  fi
-fi
-"""
+class ShellInventoryGenerator(object):
+    """
+    Runs an inventory script from the root dir and writes its output as a static inventory file
+
+    With max_age on the entry the output is cached like the plugin entries, keyed by the
+    script and its args, along with how long the script took and how much it returned.
+    """
 
-    def __init__(self, cluster_config_path, cluster_name):
+    def __init__(self, cluster_config_path, cluster_name, ops_config):
         self.cluster_name = cluster_name
+        self.cache_dir = ops_config.get('cache.dir')
+        self.serializer = caching.get_serializer(ops_config.get('cache.format'))
 
         clusters_dirname = os.path.dirname(cluster_config_path)
         self.legacy_root_dir = os.path.realpath(
@@ -276,17 +548,56 @@ fi
 
         return command
 
-    def generate(self, dest, config):
-        script_content = self.template.format(
-            root_dir=self.legacy_root_dir,
-            script=self.get_script(config)
-        )
+    def generate(self, dest, config, index=0):
+        result = self.get_script_result(self.get_script(config), config)
 
-        script_dest = "%s/%s.sh" % (dest, self.cluster_name)
+        inventory_dest = "%s/%s-%03d.json" % (dest, self.cluster_name, index)
+        write_static_inventory(inventory_dest, result['inventory'])
 
-        with open(script_dest, 'w+') as f:
-            f.write(script_content)
-            os.fchmod(f.fileno(), 0o500)
+    def get_script_result(self, command, config):
+        """ Runs the script, or reuses its output when the entry has its own max_age """
+        max_age = config.get('max_age')
+        if not max_age:
+            return self.run_script(command)
+
+        ran = []
+
+        def run_script():
+            ran.append(True)
+            return self.run_script(command)
+
+        result = caching.cache_callback_result(
+            self.cache_dir,
+            run_script,
+            int(max_age),
+            dict(script=command, root_dir=self.legacy_root_dir),
+            refresh=os.environ.get('REFRESH_CACHE') == 'True',
+            serializer=self.serializer)
+        if not ran:
+            logger.info("Using the cached output of inventory script %s, %d bytes that took "
+                        "%.2fs, max_age=%s", command, result['size'], result['duration'], max_age)
+        return result
+
+    def run_script(self, command):
+        started = time.time()
+        process = subprocess.run(command, shell=True, cwd=self.legacy_root_dir,
+                                 stdout=subprocess.PIPE, universal_newlines=True)
+        duration = time.time() - started
+        if process.returncode != 0:
+            raise OpsException("Inventory script %s failed with exit code %d" %
+                               (command, process.returncode))
+
+        try:
+            inventory = json.loads(process.stdout)
+        except ValueError as e:
+            raise OpsException("Inventory script %s did not return JSON: %s" % (command, e))
+
+        display(
+            "Inventory script %s ran in %.2fs and returned %d bytes" %
+            (command, duration, len(process.stdout)),
+            color='blue', stderr=True)
+
+        return dict(inventory=inventory, duration=round(duration, 3), size=len(process.stdout))
 
 
 class AnsibleInventory(object):
@@ -296,6 +607,12 @@ class AnsibleInventory(object):
         :type inventory_generator: ops.inventory.generator.InventoryGenerator
         """
 
+        import ansible.inventory as ansible_inventory
+        import ansible.vars as ansible_vars
+        from ansible.inventory.manager import InventoryManager
+        from ansible.parsing.dataloader import DataLoader
+        from ansible.vars.manager import VariableManager
+
         self.inventory_generator = inventory_generator
         self.generated_path, self.ssh_config_path = inventory_generator.generate()
 
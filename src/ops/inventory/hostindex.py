@@ -0,0 +1,271 @@
+# Copyright 2019 Adobe. All rights reserved.
+# This file is licensed to you under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+
+import fnmatch
+import logging
+import os
+import re
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+# the host vars that ssh and sync need to connect, and that ops inventory lists
+INDEXED_VARS = ('ansible_ssh_host', 'ansible_host', 'ansible_port', 'ansible_user',
+                'private_ip_address', 'ec2_InstanceId')
+
+# hosts that Ansible adds on its own when they are not in the inventory
+IMPLICIT_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+SUBSCRIPT = re.compile(r'^(.+)\[(?:(-?[0-9]+)|([0-9]+)[:-]([0-9]+)?)\]$')
+
+
+class IndexedHost(object):
+    def __init__(self, name, vars, index=None):
+        self.name = name
+        self.vars = vars
+        self._index = index
+
+    def get_vars(self):
+        return self.vars
+
+    def get_groups(self):
+        if not self._index:
+            return []
+        return [IndexedGroup(name) for name in self._index.get_groups(self.name)]
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return self.name
+
+
+class IndexedGroup(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class DictIndex(object):
+    """ The index as loaded from the host_index file """
+
+    def __init__(self, data):
+        self.groups = data['groups']
+        self.hosts = data['hosts']
+        self._host_groups = None
+
+    def match_groups(self, term, glob):
+        """ Returns whether any group matched, and the hosts of the matching groups in order """
+        if not glob:
+            return term in self.groups, list(self.groups.get(term, []))
+
+        names = fnmatch.filter(self.groups, term)
+        return bool(names), [host for name in names for host in self.groups[name]]
+
+    def match_hosts(self, term, glob):
+        if not glob:
+            return [term] if term in self.hosts else []
+        return fnmatch.filter(self.hosts, term)
+
+    def get_vars(self, name):
+        return self.hosts.get(name)
+
+    def get_groups(self, name):
+        if self._host_groups is None:
+            self._host_groups = {}
+            for group, hosts in self.groups.items():
+                for host in hosts:
+                    self._host_groups.setdefault(host, []).append(group)
+
+        return self._host_groups.get(name, [])
+
+
+class HostIndex(object):
+    """
+    Resolves host patterns for ssh, sync and inventory without building Ansible's inventory
+
+    The index holds group -> ordered hosts and host -> a few vars. It is written
+    next to the inventory when it is generated, or the first time it is needed for
+    inventories generated by older versions, and reused for as long as the inventory is cached.
+    The inventory itself is only generated when first needed. With
+    inventory.sqlite_index the SQLite index under cache.dir is used instead when it
+    has the inventory. Patterns the index cannot answer exactly (regexes, character
+    classes) go to Ansible.
+    """
+
+    def __init__(self, inventory_generator, ansible_inventory_factory, ops_config):
+        """
+        :type ansible_inventory_factory: () -> ops.inventory.generator.AnsibleInventory
+        """
+
+        self.inventory_generator = inventory_generator
+        self.ansible_inventory_factory = ansible_inventory_factory
+        self.serializer = caching.get_serializer(ops_config.get('cache.format'))
+        self.sqlite_path = None
+        if ops_config.get('inventory.sqlite_index'):
+            self.sqlite_path = get_sqlite_path(ops_config)
+        self._generated = None
+        self._index = None
+
+    @property
+    def generated_path(self):
+        return self.generate()[0]
+
+    @property
+    def ssh_config_path(self):
+        return self.generate()[1]
+
+    @property
+    def index_path(self):
+        return get_index_path(self.generated_path)
+
+    def generate(self):
+        if self._generated is None:
+            self._generated = self.inventory_generator.generate()
+        return self._generated
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self.load()
+        return self._index
+
+    @property
+    def ansible_inventory(self):
+        return self.ansible_inventory_factory()
+
+    def load(self):
+        if self.sqlite_path:
+            from .sqliteindex import SqliteIndex
+            index = SqliteIndex.open(self.sqlite_path, self.generated_path)
+            if index:
+                return index
+
+        if os.path.isfile(self.index_path):
+            try:
+                return DictIndex(caching.read(self.index_path))
+            except Exception as e:
+                logger.warning("Cannot read the host index %s, rebuilding it: %s",
+                               self.index_path, e)
+
+        data = build(self.ansible_inventory.inventory)
+        caching.write(self.index_path, data, self.serializer)
+        return DictIndex(data)
+
+    def get_hosts(self, pattern):
+        names = self.match(pattern)
+        if names is None:
+            logger.info("Pattern %s is not supported by the host index, "
+                        "loading the Ansible inventory", pattern)
+            return self.ansible_inventory.get_hosts(pattern)
+
+        return [self.get_host(name) for name in names]
+
+    def get_host(self, name):
+        name = str(name)
+        vars = self.index.get_vars(name)
+        if vars is None:
+            return self.ansible_inventory.get_host(name)
+
+        return IndexedHost(name, vars, self.index)
+
+    def get_ssh_config(self):
+        return self.ssh_config_path.get("ssh.config")
+
+    def match(self, pattern):
+        """ Returns the host names matching an Ansible pattern, in Ansible's order
+
+        Supports comma separated group and host names or globs, &intersections,
+        !exclusions and [n] / [n:m] subscripts. Returns None for anything else.
+        """
+
+        terms = [term.strip() for term in pattern.split(',') if term.strip()]
+        # outside of the subscripts ':' is a separator, like ','
+        if any(':' in term and not SUBSCRIPT.match(term) for term in terms):
+            return None
+
+        regular = [term for term in terms if term[0] not in '&!']
+        intersections = [term[1:] for term in terms if term[0] == '&']
+        exclusions = [term[1:] for term in terms if term[0] == '!']
+
+        hosts = []
+        seen = set()
+        for term in regular or ['all']:
+            matched = self.match_term(term)
+            if matched is None:
+                return None
+            for name in matched:
+                if name not in seen:
+                    seen.add(name)
+                    hosts.append(name)
+
+        for term in intersections:
+            matched = self.match_term(term)
+            if matched is None:
+                return None
+            matched = set(matched)
+            hosts = [name for name in hosts if name in matched]
+
+        for term in exclusions:
+            matched = self.match_term(term)
+            if matched is None:
+                return None
+            matched = set(matched)
+            hosts = [name for name in hosts if name not in matched]
+
+        return hosts
+
+    def match_term(self, term):
+        subscript = SUBSCRIPT.match(term)
+        if subscript:
+            term = subscript.group(1)
+
+        if term[0] == '~' or '[' in term or term in IMPLICIT_HOSTS:
+            return None
+
+        glob = '*' in term or '?' in term
+        groups_matched, matched = self.index.match_groups(term, glob)
+        # like Ansible, globs and names with a dot are also looked up as hosts
+        if not groups_matched or glob or '.' in term:
+            matched.extend(self.index.match_hosts(term, glob))
+
+        if not subscript:
+            return matched
+
+        index, start, end = subscript.group(2, 3, 4)
+        if index is not None:
+            index = int(index)
+            if not -len(matched) <= index < len(matched):
+                # Ansible reports it as an error
+                return None
+            return [matched[index]]
+
+        start = int(start)
+        end = int(end) + 1 if end else None
+        return matched[start:end]
+
+
+def build(inventory):
+    """ Builds the index data from an Ansible InventoryManager """
+    groups = dict((name, [host.name for host in group.get_hosts()])
+                  for name, group in inventory.groups.items())
+    hosts = dict((host.name, dict((key, host.vars[key])
+                                  for key in INDEXED_VARS if key in host.vars))
+                 for host in inventory.hosts.values())
+
+    return dict(groups=groups, hosts=hosts)
+
+
+def get_index_path(generated_path):
+    return os.path.join(os.path.dirname(generated_path), 'host_index')
+
+
+def get_sqlite_path(ops_config):
+    return os.path.join(os.path.expanduser(ops_config.get('cache.dir')), 'inventory.sqlite')
@@ -8,8 +8,44 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
-from .ec2 import ec2
-from .cns import cns
-from .legacy_pcs import legacy_pcs
-from .azr import azr
-from .skms import skms
+import importlib
+import sys
+import types
+
+# the plugins pull in boto3, the Azure SDK and requests, they are imported on first use
+PLUGINS = ('ec2', 'legacy_pcs', 'cns', 'azr', 'skms')
+
+
+class PluginPackage(types.ModuleType):
+    """ Keeps the plugin functions bound to their names when their submodules get imported
+
+    Importing a submodule binds it to the package under its name, which is also the
+    name of the plugin function the package exports.
+    """
+
+    def __setattr__(self, name, value):
+        if name in PLUGINS and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super(PluginPackage, self).__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = PluginPackage
+
+
+def __getattr__(name):
+    if name not in PLUGINS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    importlib.import_module('.' + name, __name__)
+    return globals()[name]
+
+
+class LazyPlugin(object):
+    """ Stands for an inventory plugin function until it is called """
+
+    def __init__(self, name):
+        self.__name__ = name
+        self.__module__ = '%s.%s' % (__name__, name)
+
+    def __call__(self, args):
+        return getattr(sys.modules[__name__], self.__name__)(args)
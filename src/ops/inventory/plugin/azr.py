@@ -9,7 +9,11 @@
 # governing permissions and limitations under the License.
 
 
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
 from ops.inventory.azurerm import *
+from ops.inventory import throttling
 from ansible.playbook.play import display
 from six import iteritems
 
@@ -47,21 +51,24 @@ class OpsAzureInventory(AzureInventory):
             'tags': None,
             'locations': None,
             'no_powerstate': False,
+            'concurrency': None,
             'bastion_tag': 'Adobe:Class'
         }
         if not HAS_AZURE:
             raise HAS_AZURE_EXC
 
         self._dict_args.update(args)
-        if self._dict_args['subscription_id'] is not None:
-            self._dict_args.update(
-                {'subscription_id': str(self._dict_args['subscription_id'])})
+        subscriptions = to_list(self._dict_args['subscription_id'])
+        self._dict_args['subscription_id'] = subscriptions[0] if subscriptions else None
         self._args = DictGlue(self._dict_args)
         rm = AzureRM(self._args)
 
-        self._compute_client = rm.compute_client
-        self._network_client = rm.network_client
-        self._resource_client = rm.rm_client
+        # the credentials are shared, each subscription gets its own clients
+        self._subscriptions = [rm.for_subscription(subscription)
+                               for subscription in subscriptions] or [rm]
+        self._compute_client = None
+        self._network_client = None
+        self._resource_client = None
         self._security_groups = None
         self.resource_groups = []
         self.tags = None
@@ -72,6 +79,7 @@ class OpsAzureInventory(AzureInventory):
         self.group_by_security_group = False
         self.group_by_tag = True
         self.include_powerstate = True
+        self.concurrency = self._args.concurrency
 
         self._inventory = dict(
             _meta=dict(
@@ -82,7 +90,7 @@ class OpsAzureInventory(AzureInventory):
         self._get_settings()
 
         if self._args.resource_groups:
-            self.resource_groups = self._args.resource_groups.split(',')
+            self.resource_groups = to_list(self._args.resource_groups)
 
         if self._args.tags:
             self.tags = self._args.tags.split(',')
@@ -118,7 +126,7 @@ class OpsAzureInventory(AzureInventory):
                         (self._args.bastion_tag in hostvars['tags'] and
                          hostvars['tags'][self._args.bastion_tag] == 'bastion'):
                     pass
-                else:
+                elif hostvars['location'] in bastions:
                     private_ip = hostvars['private_ip']
                     self._inventory['_meta']['hostvars'][host]['ansible_ssh_host'] = \
                         bastions[hostvars['location']] + '--' + private_ip
@@ -126,6 +134,61 @@ class OpsAzureInventory(AzureInventory):
     def get_as_json(self, pretty=False):
         return self._json_format_dict(pretty=pretty)
 
+    def get_inventory(self):
+        """ Fetches the resource groups of all the subscriptions concurrently
+
+        Up to the concurrency arg, POWERSTATE_CONCURRENCY by default, at a time: each fetch
+        gets as many power states side by side. The machines are added in the order of the
+        subscriptions and resource groups, whatever order the fetches complete in
+        """
+
+        max_workers = self.concurrency or POWERSTATE_CONCURRENCY
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            subscriptions = list(executor.map(self._for_subscription, self._subscriptions))
+
+        fetches = [(subscription, resource_group) for subscription in subscriptions
+                   for resource_group in self.resource_groups or [None]]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda fetch: fetch[0]._fetch_host_vars(fetch[1]), fetches))
+
+        for host_vars in results:
+            for vars in host_vars:
+                self._add_host(vars)
+
+    def _for_subscription(self, rm):
+        """ Returns a copy of the inventory that lists the machines of the subscription of rm """
+        throttler = throttling.get('azure')
+        inventory = copy.copy(self)
+        inventory.subscription_id = rm.subscription_id
+        inventory._compute_client = throttling.ThrottledClient(rm.compute_client, throttler)
+        inventory._network_client = throttling.ThrottledClient(rm.network_client, throttler)
+        inventory._resource_client = throttling.ThrottledClient(rm.rm_client, throttler)
+        return inventory
+
+    def _fetch_host_vars(self, resource_group=None):
+        inventory = copy.copy(self)
+        # security groups are cached per resource group name, which is only unique
+        # in a subscription
+        inventory._security_groups = None
+
+        try:
+            if resource_group:
+                virtual_machines = list(self._compute_client.virtual_machines.list(resource_group))
+            else:
+                virtual_machines = list(self._compute_client.virtual_machines.list_all())
+        except Exception as exc:
+            sys.exit("Error: fetching virtual machines of subscription {0} resource group {1} - "
+                     "{2}".format(self.subscription_id, resource_group or '*', str(exc)))
+
+        if self._args.host or self.tags or (self.locations and not resource_group):
+            virtual_machines = self._selected_machines(virtual_machines)
+
+        host_vars = inventory._get_host_vars(virtual_machines)
+        for vars in host_vars:
+            vars['subscription_id'] = self.subscription_id
+        return host_vars
+
     def _selected_machines(self, virtual_machines):
         selected_machines = []
         for machine in virtual_machines:
@@ -146,6 +209,15 @@ class OpsAzureInventory(AzureInventory):
         return selected_machines
 
 
+def to_list(value):
+    """ Accepts lists and comma separated strings """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return [item.strip() for item in str(value).split(',') if item.strip()]
+
+
 def azr(args={}):
     """Eventual filtering will be done here after we will define how we group and tag resources"""
-    return OpsAzureInventory(args).get_as_json(pretty=True)
+    return OpsAzureInventory(args).get_as_json()
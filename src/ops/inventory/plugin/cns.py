@@ -10,7 +10,9 @@
 
 import json
 
-from .ec2 import ec2
+from ops import boto3pool
+from ops.inventory.ec2inventory import Ec2Inventory
+from ops.inventory.orderedset import OrderedSet
 
 
 def cns(args):
@@ -19,33 +21,99 @@ def cns(args):
     if 'clusters' not in args:
         raise Exception('clusters entry is missing in the cns plugin args')
 
+    # all the names sharing a region and a profile are fetched with one query
+    batches = {}
     for cluster in args['clusters']:
-        region = cluster['region']
-        profile = cluster['boto_profile']
+        batches.setdefault((cluster['region'], cluster['boto_profile']), []).extend(
+            name for name in cluster['names'] if not is_pattern(name))
+
+    # create the ec2 clients of the different profiles side by side while the first batch runs,
+    # one per region of the comma separated lists, like Ec2Inventory does
+    boto3pool.pool.warm_up([(profile, region, 'ec2') for regions, profile in batches
+                            for region in regions.split(',')])
+
+    partitions = {}
+    for (region, profile), names in batches.items():
+        if names:
+            partitions[(region, profile)] = cns_inventory(
+                args, region, profile, names).get_partitioned('cluster')
+
+    # merge in the configured order, as if each name had been queried on its own
+    for cluster in args['clusters']:
+        region, profile = cluster['region'], cluster['boto_profile']
+        cluster_partitions = partitions.get((region, profile), {})
         for cns_cluster in cluster['names']:
-            jsn = ec2(dict(
-                region=region,
-                boto_profile=profile,
-                cache=args.get('cache', 3600 * 24),
-                filters=[
-                    {'Name': 'tag:cluster', 'Values': [cns_cluster]}
-                ],
-                bastion=[
-                    {'Name': 'tag:cluster', 'Values': [cns_cluster]},
-                    {'Name': 'tag:role', 'Values': ['bastion']}
-                ]
-            ))
+            if is_pattern(cns_cluster):
+                # the clusters a pattern matches share one bastion, they are queried together
+                inventory = cns_inventory(args, region, profile, [cns_cluster])
+                inventory.do_api_calls_update_cache()
+                merge_inventories(result, inventory.inventory)
+            elif cns_cluster in cluster_partitions:
+                merge_inventories(result, cluster_partitions[cns_cluster].inventory)
+
+    return json.dumps(result, separators=(',', ':'), default=list)
+
 
-            merge_inventories(result, json.loads(jsn))
+def is_pattern(name):
+    """ EC2 filter values match * and ? as wildcards """
+    return '*' in name or '?' in name
 
-    return json.dumps(result, sort_keys=True, indent=2)
+
+def cns_inventory(args, region, profile, names):
+    return Ec2Inventory(
+        boto_profile=profile,
+        regions=region,
+        filters=[
+            {'Name': 'tag:cluster', 'Values': names}
+        ],
+        bastion_filters=[
+            {'Name': 'tag:cluster', 'Values': names},
+            {'Name': 'tag:role', 'Values': ['bastion']}
+        ],
+        concurrency=args.get('concurrency'),
+        hostvars=args.get('hostvars'),
+        groups=args.get('groups')
+    )
 
 
 def merge_inventories(a, b):
+    """ Merges inventory b into a, the hosts of the groups are kept unique
+
+    Merged groups become OrderedSets, or dicts of OrderedSets for the groups with children,
+    serialize the result with json.dumps(..., default=list)
+    """
     for k, v in b.items():
-        if not a.get(k):
-            a[k] = b[k]
-        elif isinstance(a[k], list):
-            a[k].extend(b[k])
-        elif k == '_meta':
-            a[k]['hostvars'].update(b[k]['hostvars'])
+        if k == '_meta':
+            if not a.get(k):
+                a[k] = v
+            else:
+                a[k]['hostvars'].update(v['hostvars'])
+        elif isinstance(a.get(k), dict) or isinstance(v, dict):
+            group = a[k] = to_group_dict(a.get(k))
+            for key, value in v.items() if isinstance(v, dict) else [('hosts', v)]:
+                if key in ('hosts', 'children'):
+                    group.setdefault(key, OrderedSet()).update(value or [])
+                elif key == 'vars':
+                    group.setdefault(key, {}).update(value or {})
+                else:
+                    group[key] = value
+        elif not a.get(k):
+            a[k] = OrderedSet(v)
+        else:
+            if not isinstance(a[k], OrderedSet):
+                a[k] = OrderedSet(a[k])
+            a[k].update(v)
+
+
+def to_group_dict(group):
+    """ A group as a dict, with its hosts and children as OrderedSets """
+    if not group:
+        return {}
+    if not isinstance(group, dict):
+        return {'hosts': OrderedSet(group)}
+
+    group = dict(group)
+    for key in ('hosts', 'children'):
+        if key in group:
+            group[key] = OrderedSet(group[key] or [])
+    return group
@@ -27,4 +27,7 @@ def ec2(args):
     return Ec2Inventory(boto_profile=args['boto_profile'],
                         regions=args['region'],
                         filters=filters,
-                        bastion_filters=bastion_filters).get_as_json()
+                        bastion_filters=bastion_filters,
+                        concurrency=args.get('concurrency'),
+                        hostvars=args.get('hostvars'),
+                        groups=args.get('groups')).get_as_json()
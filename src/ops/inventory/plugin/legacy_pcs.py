@@ -34,4 +34,4 @@ def legacy_pcs(args):
 
         merge_inventories(result, json.loads(jsn))
 
-    return json.dumps(result, sort_keys=True, indent=2)
+    return json.dumps(result, separators=(',', ':'), default=list)
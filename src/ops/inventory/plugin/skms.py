@@ -10,11 +10,25 @@
 
 from ops.cli import display
 from ansible.utils.color import stringc
+from ops.inventory import throttling
 from ops.inventory.SKMS import WebApiClient
 from ansible.playbook.play import display
 import sys
 import yaml
 import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+PAGE_SIZE = 5000
+
+# pages fetched at the same time, after the first one
+CONCURRENCY = 4
+
+DEVICE_QUERY = "SELECT device_id, name, operating_system.display_name " \
+    "as operating_system, device_service.full_name AS device_service, " \
+    "environment.full_name AS environment, primary_ip_address.ip_address " \
+    "AS primary_ip_address WHERE environment.full_name = \"%s\" PAGE %d, %d"
 
 
 def skms(args):
@@ -26,7 +40,12 @@ def skms(args):
         args:
           skms:
             endpoint: api.skms.mycompany.com
+            # reuse the SKMS session and CSRF token across runs (default)
+            session_optimization: true
           environment: 'Solution Name - OR1 - Production'
+          # devices per query page, and pages queried at the same time
+          page_size: 5000
+          concurrency: 4
           strip:
             device_service: 'Solution Name - '
             environment: 'Solution Name - OR1 - '
@@ -57,26 +76,13 @@ def skms(args):
     conn = WebApiClient(
         args['skms']['username'],
         args['skms']['password'],
-        args['skms']['endpoint'])
-    query = {'request_arr': []}
-    query_list = []
-    query_list.append('details')
-    query_list.append('attributes')
-
-    query['request_arr'].append({'object': 'DeviceDao', 'method': 'search', 'parameters': {
-                                'query': "SELECT device_id, name, operating_system.display_name "
-                                "as operating_system, device_service.full_name AS device_service, "
-                                "environment.full_name AS environment, primary_ip_address.ip_address "
-                                "AS primary_ip_address WHERE environment.full_name = \"%s\" PAGE 1, 5000"
-                                % args['environment']}})
+        args['skms']['endpoint'],
+        enable_session_optimization=args['skms'].get('session_optimization', True))
+    conn.throttler = throttling.get('skms')
 
-    conn.send_request('SkmsWebApi', 'performMultipleRequests', query)
-
-    response = conn.get_response_dictionary()
-
-    if response['status'] == 'error':
-        display(stringc('SKMS query produced an error: %s' % response, 'red'))
-        sys.exit(1)
+    devices = fetch_devices(conn, args['environment'],
+                            int(args.get('page_size', PAGE_SIZE)),
+                            int(args.get('concurrency', CONCURRENCY)))
 
     if 'device_service' in args['strip']:
         device_service_strip = args['strip']['device_service']
@@ -93,13 +99,11 @@ def skms(args):
     else:
         hostname_strip = ''
 
-    dictionary_of_hosts = {
-        '_meta': {
-            'hostvars': {}
-        }
-    }
+    # group name -> hosts, the hosts dict is an insertion ordered set
+    groups = {}
+    hostvars = {}
 
-    for info in response['data']['result_arr'][0]['data']['results']:
+    for info in devices:
         # Raising warning when primary ip is unavailable !!!
         if info['primary_ip_address'] is None:
             display.display(
@@ -118,79 +122,90 @@ def skms(args):
         info['site'] = info['name'].split('-')[0]
         info['cluster'] = '-'.join(info['name'].split('-')[:2])
 
-        # step through device services to add them as groups
+        # the device services, environment, primary ip, owner, site and cluster are all groups
+        device_service = ''
         for device_service in info['device_service']:
-            device_service = device_service.replace(
-                device_service_strip, '').encode('utf-8')
-
-            # add device service to top-level dictionary as a group
-            if device_service not in dictionary_of_hosts:
-                dictionary_of_hosts[device_service] = {"hosts": []}
-            # add host to array of that device service group
-            if info['name'] not in dictionary_of_hosts[device_service]['hosts']:
-                dictionary_of_hosts[device_service]['hosts'].append(
-                    info['name'].encode('utf-8'))
-
-        # add environment to top-level dictionary as a group
-        if info['environment'] not in dictionary_of_hosts:
-            dictionary_of_hosts[info['environment'].encode(
-                'utf-8')] = {"hosts": []}
-        # add host to array of that environment group
-        if info['name'] not in dictionary_of_hosts[info['environment']]['hosts']:
-            dictionary_of_hosts[info['environment']]['hosts'].append(
-                info['name'].encode('utf-8'))
-
-        # add primary_ip_address to top-level dictionary as a group
-        if info['primary_ip_address'] not in dictionary_of_hosts:
-            dictionary_of_hosts[info['primary_ip_address'].encode(
-                'utf-8')] = {"hosts": []}
-        if info['name'] not in dictionary_of_hosts[info['primary_ip_address']]['hosts']:
-            dictionary_of_hosts[info['primary_ip_address']
-                                ]['hosts'].append(info['name'].encode('utf-8'))
-
-        # add owner to top-level dictionary as a group
-        if info['owner'] not in dictionary_of_hosts:
-            dictionary_of_hosts[info['owner'].encode('utf-8')] = {"hosts": []}
-        if info['name'] not in dictionary_of_hosts[info['owner']]['hosts']:
-            dictionary_of_hosts[info['owner']]['hosts'].append(
-                info['name'].encode('utf-8'))
-
-        # add site to top-level dictionary as a group
-        if info['site'] not in dictionary_of_hosts:
-            dictionary_of_hosts[info['site'].encode('utf-8')] = {"hosts": []}
-        if info['name'] not in dictionary_of_hosts[info['site']]['hosts']:
-            dictionary_of_hosts[info['site']]['hosts'].append(
-                info['name'].encode('utf-8'))
-
-        # add cluster to top-level dictionary as a group
-        if info['cluster'] not in dictionary_of_hosts:
-            dictionary_of_hosts[info['cluster'].encode(
-                'utf-8')] = {"hosts": []}
-        if info['name'] not in dictionary_of_hosts[info['cluster']]['hosts']:
-            dictionary_of_hosts[info['cluster']]['hosts'].append(
-                info['name'].encode('utf-8'))
+            device_service = device_service.replace(device_service_strip, '')
+            groups.setdefault(device_service, {})[info['name']] = None
+
+        for key in ('environment', 'primary_ip_address', 'owner', 'site', 'cluster'):
+            groups.setdefault(info[key], {})[info['name']] = None
 
         # tie some extra information to hostname in the meta variables
-        dictionary_of_hosts['_meta']['hostvars'][info['name'].encode('utf-8')] = {
-            'ec2_id': info['device_id'].encode('utf-8'),
-            'ansible_ssh_host': info['primary_ip_address'].encode('utf-8'),
-            'ansible_host': info['primary_ip_address'].encode('utf-8'),
-            'computer_name': info['computer_name'].encode('utf-8'),
-            'location': info['location_name'].encode('utf-8'),
-            'name': info['name'].split('.')[0].encode('utf-8'),
-            'operating_system': info['operating_system'].encode('utf-8'),
-            'private_ip': info['primary_ip_address'].encode('utf-8'),
+        hostvars[info['name']] = {
+            'ec2_id': info['device_id'],
+            'ansible_ssh_host': info['primary_ip_address'],
+            'ansible_host': info['primary_ip_address'],
+            'computer_name': info['computer_name'],
+            'location': info['location_name'],
+            'name': info['name'].split('.')[0],
+            'operating_system': info['operating_system'],
+            'private_ip': info['primary_ip_address'],
             'tags': {
-                'Adobe:Environment': info['environment'].encode('utf-8'),
-                'Adobe:Owner': info['owner'].encode('utf-8'),
-                'CMDB_device_service': device_service.encode('utf-8'),
-                'CMDB_environment': info['environment'].encode('utf-8'),
-                'CMDB_hostname': info['name'].split('.')[0].encode('utf-8'),
-                'cluster': info['cluster'].encode('utf-8'),
-                'environment': info['environment'].encode('utf-8'),
-                'role': device_service.encode('utf-8'),
-                'site': info['site'].encode('utf-8'),
+                'Adobe:Environment': info['environment'],
+                'Adobe:Owner': info['owner'],
+                'CMDB_device_service': device_service,
+                'CMDB_environment': info['environment'],
+                'CMDB_hostname': info['name'].split('.')[0],
+                'cluster': info['cluster'],
+                'environment': info['environment'],
+                'role': device_service,
+                'site': info['site'],
             }
         }
 
+    dictionary_of_hosts = dict((name, {'hosts': list(hosts)}) for name, hosts in groups.items())
+    dictionary_of_hosts['_meta'] = {'hostvars': hostvars}
+
     return dictionary_of_hosts
+
+
+def fetch_devices(conn, environment, page_size, concurrency):
+    """ Yields the devices of the environment, page by page and in order
+
+    The first page also opens the SKMS session, the next pages are queried
+    concurrently over the same pooled connections until one comes back short
+    """
+
+    results = query_devices(conn, environment, 1, page_size)
+    for info in results:
+        yield info
+    if len(results) < page_size:
+        return
+
+    next_page = 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            while len(pending) < concurrency:
+                pending.append(executor.submit(
+                    query_devices, conn.clone(), environment, next_page, page_size))
+                next_page += 1
+
+            results = pending.popleft().result()
+            for info in results:
+                yield info
+            if len(results) < page_size:
+                break
+
+        for future in pending:
+            future.cancel()
+
+
+def query_devices(conn, environment, page, page_size):
+    query = {'request_arr': [{'object': 'DeviceDao', 'method': 'search', 'parameters': {
+        'query': DEVICE_QUERY % (environment, page, page_size)}}]}
+
+    conn.send_request('SkmsWebApi', 'performMultipleRequests', query)
+
+    response = conn.get_response_dictionary()
+
+    if not response:
+        display.display('SKMS query failed: %s' % conn.get_error_message(), color='red')
+        sys.exit(1)
+
+    if response['status'] == 'error':
+        display.display('SKMS query produced an error: %s' % response, color='red')
+        sys.exit(1)
+
+    return response['data']['result_arr'][0]['data']['results']
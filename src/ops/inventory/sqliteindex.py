@@ -0,0 +1,175 @@
+# Copyright 2019 Adobe. All rights reserved.
+# This file is licensed to you under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# generated dirs removed per statement, SQLite allows 999 variables before 3.32
+REMOVE_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventories (
+    id INTEGER PRIMARY KEY,
+    inventory_key TEXT NOT NULL UNIQUE,
+    generated_path TEXT NOT NULL UNIQUE,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inventory_hosts (
+    inventory_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    vars TEXT NOT NULL,
+    PRIMARY KEY (inventory_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS inventory_groups (
+    inventory_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (inventory_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS group_hosts (
+    inventory_id INTEGER NOT NULL,
+    group_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    host_name TEXT NOT NULL,
+    PRIMARY KEY (inventory_id, group_name, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS group_hosts_by_host ON group_hosts (inventory_id, host_name);
+"""
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=30)
+    # readers never block the writer of another cluster, and the other way around
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def update(path, inventory_key, generated_path, data):
+    """ Replaces the indexed inventory of inventory_key with the hostindex.build() data """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = connect(path)
+    try:
+        with connection:
+            previous = connection.execute(
+                'SELECT id FROM inventories WHERE inventory_key = ? OR generated_path = ?',
+                (inventory_key, generated_path)).fetchall()
+            for table in ('inventory_hosts', 'inventory_groups', 'group_hosts'):
+                connection.executemany('DELETE FROM %s WHERE inventory_id = ?' % table, previous)
+            connection.executemany('DELETE FROM inventories WHERE id = ?', previous)
+
+            inventory_id = connection.execute(
+                'INSERT INTO inventories (inventory_key, generated_path, updated_at) '
+                'VALUES (?, ?, ?)',
+                (inventory_key, generated_path, time.time())).lastrowid
+
+            connection.executemany(
+                'INSERT INTO inventory_hosts VALUES (?, ?, ?, ?)',
+                ((inventory_id, name, position, json.dumps(vars))
+                 for position, (name, vars) in enumerate(data['hosts'].items())))
+            connection.executemany(
+                'INSERT INTO inventory_groups VALUES (?, ?, ?)',
+                ((inventory_id, name, position) for position, name in enumerate(data['groups'])))
+            connection.executemany(
+                'INSERT INTO group_hosts VALUES (?, ?, ?, ?)',
+                ((inventory_id, group, position, host)
+                 for group, hosts in data['groups'].items()
+                 for position, host in enumerate(hosts)))
+    finally:
+        connection.close()
+
+
+def remove(path, generated_paths):
+    """ Drops the indexed inventories of generated inventory dirs that were deleted """
+
+    generated_paths = list(generated_paths)
+    connection = connect(path)
+    try:
+        with connection:
+            removed = []
+            # SQLite bounds the number of variables of a statement
+            for start in range(0, len(generated_paths), REMOVE_BATCH_SIZE):
+                batch = generated_paths[start:start + REMOVE_BATCH_SIZE]
+                removed.extend(connection.execute(
+                    'SELECT id FROM inventories WHERE generated_path IN (%s)' %
+                    ','.join('?' * len(batch)), batch).fetchall())
+            for table in ('inventory_hosts', 'inventory_groups', 'group_hosts'):
+                connection.executemany('DELETE FROM %s WHERE inventory_id = ?' % table, removed)
+            connection.executemany('DELETE FROM inventories WHERE id = ?', removed)
+    finally:
+        connection.close()
+
+
+class SqliteIndex(object):
+    """ HostIndex backend answering the lookups of one inventory with indexed queries """
+
+    def __init__(self, connection, inventory_id):
+        self.connection = connection
+        self.inventory_id = inventory_id
+
+    @classmethod
+    def open(cls, path, generated_path):
+        """ Returns the index of the generated inventory, or None when it is not indexed """
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            connection = connect(path)
+            row = connection.execute('SELECT id FROM inventories WHERE generated_path = ?',
+                                     (generated_path,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Cannot read the inventory index %s: %s", path, e)
+            return None
+
+        if row is None:
+            connection.close()
+            return None
+
+        return cls(connection, row[0])
+
+    def match_groups(self, term, glob):
+        operator = 'GLOB' if glob else '='
+        groups = [row[0] for row in self.connection.execute(
+            'SELECT name FROM inventory_groups WHERE inventory_id = ? AND name %s ? '
+            'ORDER BY position' % operator, (self.inventory_id, term))]
+        if not groups:
+            return False, []
+
+        hosts = self.connection.execute(
+            'SELECT m.host_name FROM inventory_groups g JOIN group_hosts m '
+            'ON m.inventory_id = g.inventory_id AND m.group_name = g.name '
+            'WHERE g.inventory_id = ? AND g.name %s ? ORDER BY g.position, m.position' % operator,
+            (self.inventory_id, term))
+        return True, [row[0] for row in hosts]
+
+    def match_hosts(self, term, glob):
+        operator = 'GLOB' if glob else '='
+        return [row[0] for row in self.connection.execute(
+            'SELECT name FROM inventory_hosts WHERE inventory_id = ? AND name %s ? '
+            'ORDER BY position' % operator, (self.inventory_id, term))]
+
+    def get_vars(self, name):
+        row = self.connection.execute(
+            'SELECT vars FROM inventory_hosts WHERE inventory_id = ? AND name = ?',
+            (self.inventory_id, name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_groups(self, name):
+        return [row[0] for row in self.connection.execute(
+            'SELECT group_name FROM group_hosts WHERE inventory_id = ? AND host_name = ?',
+            (self.inventory_id, name))]
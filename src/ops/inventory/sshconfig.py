@@ -12,7 +12,7 @@ import os
 import socketserver
 from shutil import copy
 from pathlib import Path
-from ansible.playbook.play import display
+from ops.cli import display
 
 
 class SshConfigGenerator(object):
@@ -45,13 +45,13 @@ class SshConfigGenerator(object):
             scb_proxy_port = SshConfigGenerator.get_ssh_scb_proxy_port(ssh_config_tpl_path)
             ssh_config_path = SshConfigGenerator.generate_ssh_scb_config(ssh_config_tpl_path,
                                                                          scb_proxy_port)
-            display.display(f"Connecting via scb proxy at 127.0.0.1:{scb_proxy_port}.\n"
-                            f"This proxy should have already been started and running "
-                            f"in a different terminal window.\n"
-                            f"If there are connection issues double check that "
-                            f"the proxy is running.",
-                            color='blue',
-                            stderr=True)
+            display(f"Connecting via scb proxy at 127.0.0.1:{scb_proxy_port}.\n"
+                    f"This proxy should have already been started and running "
+                    f"in a different terminal window.\n"
+                    f"If there are connection issues double check that "
+                    f"the proxy is running.",
+                    color='blue',
+                    stderr=True)
         else:
             ssh_config_path = ssh_config_paths.get(SshConfigGenerator.SSH_CONFIG_FILE)
         return ssh_config_path
@@ -62,14 +62,14 @@ class SshConfigGenerator(object):
         if auto_scb_port:
             with socketserver.TCPServer(("localhost", 0), None) as s:
                 generated_port = s.server_address[1]
-            display.display(f"Using auto generated port {generated_port} for scb proxy port",
-                            color='blue',
-                            stderr=True)
+            display(f"Using auto generated port {generated_port} for scb proxy port",
+                    color='blue',
+                    stderr=True)
         else:
             generated_port = scb_config_port
-            display.display(f"Using port {generated_port} from cluster config for scb proxy port",
-                            color='blue',
-                            stderr=True)
+            display(f"Using port {generated_port} from cluster config for scb proxy port",
+                    color='blue',
+                    stderr=True)
 
         with open(ssh_config_port_path, 'w') as f:
             f.write(str(generated_port))
@@ -0,0 +1,246 @@
+# Copyright 2019 Adobe. All rights reserved.
+# This file is licensed to you under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License. You may obtain a copy
+# of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+# OF ANY KIND, either express or implied. See the License for the specific language
+# governing permissions and limitations under the License.
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = ('ec2', 'azure', 'skms')
+
+DEFAULT_LIMITS = dict(
+    # requests per second and how many requests can be sent at once
+    rate=10,
+    burst=10,
+    # retries of a single request, and of all the requests of a run together
+    max_retries=5,
+    retry_budget=50
+)
+
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class RetryBudgetExceeded(Exception):
+    pass
+
+
+class TokenBucket(object):
+    """ Thread safe token bucket, holds at most `burst` tokens and refills `rate` of them
+    per second """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Takes a token, waiting for one if needed, and returns the seconds waited """
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class Throttler(object):
+    """
+    Rate limits and retries the calls to one provider
+
+    The rate is halved every time the provider throttles us and grows back slowly
+    with each successful call. Retries are bounded per call by max_retries and for
+    the whole process by retry_budget, so a provider that keeps refusing fails fast.
+    """
+
+    def __init__(self, provider, rate, burst, max_retries, retry_budget):
+        self.provider = provider
+        self.max_rate = float(rate)
+        self.min_rate = self.max_rate / 10
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.bucket = TokenBucket(rate, burst)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.waited = 0
+
+    def acquire(self):
+        waited = self.bucket.acquire()
+        with self._lock:
+            self.requests += 1
+            self.waited += waited
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_throttled(e):
+                    raise
+                self.on_throttled()
+                self.spend_retry(attempt, e)
+                attempt += 1
+                self.backoff(attempt, retry_after(e))
+                continue
+
+            self.on_success()
+            return result
+
+    def spend_retry(self, attempt, exc):
+        with self._lock:
+            if attempt >= self.max_retries:
+                raise exc
+            if self.retries >= self.retry_budget:
+                raise RetryBudgetExceeded("%s retry budget of %s exhausted: %s" %
+                                          (self.provider, self.retry_budget, exc))
+            self.retries += 1
+
+    def backoff(self, attempt, minimum=None):
+        # exponential backoff with full jitter
+        delay = max(minimum or 0, random.uniform(0, min(20, 0.5 * 2 ** attempt)))
+        logger.debug("%s throttled, retrying in %.2fs", self.provider, delay)
+        time.sleep(delay)
+        with self._lock:
+            self.waited += delay
+
+    def on_throttled(self):
+        with self._lock:
+            self.throttled += 1
+            self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+
+    def on_success(self):
+        if self.bucket.rate < self.max_rate:
+            with self._lock:
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 20)
+
+    def record_retries(self, retries):
+        """ Accounts for the retries done by the client itself (botocore) """
+        if retries:
+            with self._lock:
+                self.retries += retries
+
+    def stats(self):
+        return dict(requests=self.requests, throttled=self.throttled,
+                    retries=self.retries, waited=round(self.waited, 2))
+
+
+_throttlers = {}
+_lock = threading.Lock()
+
+
+def configure(ops_config):
+    """ (Re)creates the throttlers from the inventory.throttling.<provider> settings """
+    with _lock:
+        for provider in PROVIDERS:
+            _throttlers[provider] = create(
+                provider, ops_config.get('inventory.throttling.%s' % provider))
+
+        # botocore has its own adaptive rate limiting and retries, set up with the same limits
+        from botocore.config import Config
+        from ops import boto3pool
+
+        max_attempts = _throttlers['ec2'].max_retries + 1
+        boto3pool.pool.configure(
+            'ec2', Config(retries=dict(mode='adaptive', max_attempts=max_attempts)))
+
+
+def create(provider, limits=None):
+    settings = dict(DEFAULT_LIMITS)
+    settings.update(limits or {})
+    return Throttler(provider, settings['rate'], settings['burst'],
+                     settings['max_retries'], settings['retry_budget'])
+
+
+def get(provider):
+    with _lock:
+        if provider not in _throttlers:
+            _throttlers[provider] = create(provider)
+        return _throttlers[provider]
+
+
+def report():
+    """ Returns one line per provider that got throttled or retried requests """
+    with _lock:
+        throttlers = list(_throttlers.values())
+
+    return ["%s: %s requests, %s throttled, %s retries, %ss waiting" %
+            (t.provider, t.requests, t.throttled, t.retries, round(t.waited, 2))
+            for t in throttlers if t.throttled or t.retries]
+
+
+def is_throttled(exc):
+    status_code = getattr(exc, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status_code in THROTTLED_STATUS_CODES
+
+
+def retry_after(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return min(60, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+class ThrottledClient(object):
+    """ Wraps an SDK client so that calls like client.group.method(...) go through a throttler """
+
+    def __init__(self, client, throttler):
+        self._client = client
+        self._throttler = throttler
+
+    def __getattr__(self, name):
+        return ThrottledOperations(getattr(self._client, name), self._throttler)
+
+
+class ThrottledOperations(object):
+    def __init__(self, operations, throttler):
+        self._operations = operations
+        self._throttler = throttler
+
+    def __getattr__(self, name):
+        attr = getattr(self._operations, name)
+        if not callable(attr):
+            return attr
+
+        def throttled(*args, **kwargs):
+            result = self._throttler.call(attr, *args, **kwargs)
+            # list calls return a lazy msrest Paged, every page is one more request
+            if hasattr(result, 'advance_page'):
+                return throttled_pages(result, self._throttler)
+            return result
+
+        return throttled
+
+
+def throttled_pages(paged, throttler):
+    while True:
+        try:
+            page = throttler.call(paged.advance_page)
+        except StopIteration:
+            return
+        for item in page:
+            yield item
@@ -8,35 +8,48 @@
 # OF ANY KIND, either express or implied. See the License for the specific language
 # governing permissions and limitations under the License.
 
+import importlib
 import sys
 import logging
 import os
 
 from simpledi import Container, auto, cache, instance, ListInstanceProvider
 
-from .cli.config_generator import ConfigGeneratorParserConfig, ConfigGeneratorRunner
-from .cli.config import ClusterConfigGenerator, ClusterConfig
+from .cli.config_generator import ConfigGeneratorParserConfig
 from .cli.inventory import InventoryParserConfig
-from .cli.inventory import InventoryRunner
 from .cli.parser import RootParser
-from .cli.playbook import PlaybookRunner, PlaybookParserConfig
-from .cli.run import CommandRunner, CommandParserConfig
-from .cli.ssh import SshParserConfig, SshRunner
-from .cli.sync import SyncParserConfig, SyncRunner
-from .cli.terraform import TerraformParserConfig, TerraformRunner
-from .cli.helmfile import HelmfileParserConfig, HelmfileRunner
-from .cli.packer import PackerParserConfig, PackerRunner
-from .inventory.generator import DirInventoryGenerator, ShellInventoryGenerator, AnsibleInventory, \
-    PluginInventoryGenerator, InventoryGenerator, CachedInventoryGenerator
-from .inventory.plugin import ec2, legacy_pcs, cns, azr, skms
-from .inventory.sshconfig import SshConfigGenerator
+from .cli.playbook import PlaybookParserConfig
+from .cli.run import CommandParserConfig
+from .cli.ssh import SshParserConfig
+from .cli.sync import SyncParserConfig
+from .cli.terraform import TerraformParserConfig
+from .cli.helmfile import HelmfileParserConfig
+from .cli.packer import PackerParserConfig
+from .inventory.hostindex import HostIndex
+from .inventory.plugin import LazyPlugin
 from . import OpsException, Executor, validate_ops_version
-from .jinja import Template
 from .opsconfig import OpsConfig
 
 logger = logging.getLogger(__name__)
 
 
+def lazy(path):
+    """ Like auto(), for a 'module:Class' path that is only imported when the dependency
+    is first needed
+
+    The runners, generators and cluster config pull in Ansible, boto3, the Azure SDK,
+    GitPython and himl, a command only pays for the ones it uses
+    """
+
+    module_name, class_name = path.split(':')
+
+    def provider(container):
+        clz = getattr(importlib.import_module(module_name, __package__), class_name)
+        return auto(clz)(container)
+
+    return provider
+
+
 def configure_logging(args):
     if args.verbose:
         if args.verbose > 1:
@@ -54,20 +67,20 @@ class AppContainer(Container):
         self.configure_parsers()
         self.configure_inventory()
 
-        self.terraform_runner = auto(TerraformRunner)
-        self.packer_runner = auto(PackerRunner)
-        self.ssh_runner = auto(SshRunner)
-        self.play_runner = auto(PlaybookRunner)
-        self.run_runner = auto(CommandRunner)
-        self.sync_runner = auto(SyncRunner)
-        self.helmfile_runner = auto(HelmfileRunner)
-        self.config_runner = auto(ConfigGeneratorRunner)
+        self.terraform_runner = lazy('.cli.terraform:TerraformRunner')
+        self.packer_runner = lazy('.cli.packer:PackerRunner')
+        self.ssh_runner = lazy('.cli.ssh:SshRunner')
+        self.play_runner = lazy('.cli.playbook:PlaybookRunner')
+        self.run_runner = lazy('.cli.run:CommandRunner')
+        self.sync_runner = lazy('.cli.sync:SyncRunner')
+        self.helmfile_runner = lazy('.cli.helmfile:HelmfileRunner')
+        self.config_runner = lazy('.cli.config_generator:ConfigGeneratorRunner')
 
-        self.cluster_config = cache(auto(ClusterConfig))
+        self.cluster_config = cache(lazy('.cli.config:ClusterConfig'))
         self.ops_config = cache(auto(OpsConfig))
-        self.cluster_config_generator = auto(ClusterConfigGenerator)
-        self.ssh_config_generator = auto(SshConfigGenerator)
-        self.template = auto(Template)
+        self.cluster_config_generator = lazy('.cli.config:ClusterConfigGenerator')
+        self.ssh_config_generator = lazy('.inventory.sshconfig:SshConfigGenerator')
+        self.template = lazy('.jinja:Template')
 
         # bind the command executor
         self.execute = auto(Executor)
@@ -91,25 +104,28 @@ class AppContainer(Container):
         self.sub_parsers = parsers
 
     def configure_inventory(self):
-        self.inventory_runner = auto(InventoryRunner)
-        self.base_inventory_generator = cache(auto(InventoryGenerator))
-        self.inventory_generator = cache(auto(CachedInventoryGenerator))
-        self.ansible_inventory = cache(auto(AnsibleInventory))
+        self.inventory_runner = lazy('.cli.inventory:InventoryRunner')
+        self.base_inventory_generator = cache(lazy('.inventory.generator:InventoryGenerator'))
+        self.inventory_generator = cache(lazy('.inventory.generator:CachedInventoryGenerator'))
+        self.ansible_inventory = cache(lazy('.inventory.generator:AnsibleInventory'))
+        # ssh and sync resolve hosts through the index, Ansible is only loaded when needed
+        self.host_index = cache(lambda c: HostIndex(
+            c.inventory_generator, lambda: c.ansible_inventory, c.ops_config))
 
         inventory_generators = ListInstanceProvider()
-        inventory_generators.add(auto(DirInventoryGenerator))
-        inventory_generators.add(auto(ShellInventoryGenerator))
-        inventory_generators.add(auto(PluginInventoryGenerator))
+        inventory_generators.add(lazy('.inventory.generator:DirInventoryGenerator'))
+        inventory_generators.add(lazy('.inventory.generator:ShellInventoryGenerator'))
+        inventory_generators.add(lazy('.inventory.generator:PluginInventoryGenerator'))
 
         self.inventory_generators = inventory_generators
 
-        # inventory generator plugins
+        # inventory generator plugins, each one is imported when an inventory entry uses it
         inventory_plugins = ListInstanceProvider()
-        inventory_plugins.add(instance(ec2))
-        inventory_plugins.add(instance(legacy_pcs))
-        inventory_plugins.add(instance(cns))
-        inventory_plugins.add(instance(azr))
-        inventory_plugins.add(instance(skms))
+        inventory_plugins.add(instance(LazyPlugin('ec2')))
+        inventory_plugins.add(instance(LazyPlugin('legacy_pcs')))
+        inventory_plugins.add(instance(LazyPlugin('cns')))
+        inventory_plugins.add(instance(LazyPlugin('azr')))
+        inventory_plugins.add(instance(LazyPlugin('skms')))
         self.inventory_plugins = inventory_plugins
 
     def configure(self):
@@ -48,9 +48,46 @@ class OpsConfig(object):
         # cache dir
         'cache.dir': '~/.ops/cache',
 
+        # Format of the cache files: auto (msgpack when installed, compressed JSON
+        # otherwise), json, json.zlib or msgpack
+        'cache.format': 'auto',
+
+        # Generated inventory dirs under cache.dir that no valid inventory cache uses are
+        # removed once older than max_age seconds, and oldest first while all of them take
+        # more than max_size bytes and they are older than min_age seconds. It runs after an
+        # inventory is generated, at most once per interval seconds (0 disables it,
+        # `ops ... inventory --gc` runs it right away)
+        'cache.gc.max_age': 86400,
+        'cache.gc.max_size': 512 * 1024 * 1024,
+        'cache.gc.min_age': 6 * 3600,
+        'cache.gc.interval': 3600,
+
         # inventory settings
         'inventory.max_age': 600,
 
+        # Serve an expired inventory cache for this many extra seconds while it
+        # gets rebuilt in the background (0 disables it)
+        'inventory.stale_while_revalidate': 0,
+
+        # How many inventory plugin entries are fetched at the same time
+        'inventory.concurrency': 8,
+
+        # How the files of `directory` inventory entries get into the generated inventory:
+        # symlink, hardlink (copy across filesystems) or copy. Entries can set their own `link`
+        'inventory.directory_link': 'symlink',
+
+        # Index every generated inventory in an SQLite database under cache.dir, so that
+        # inventory --limit, ssh and sync resolve host patterns with indexed queries
+        'inventory.sqlite_index': False,
+
+        # Client side rate limits of the inventory API calls, per provider: requests
+        # per second, burst size, retries of a request and retries of a whole run
+        'inventory.throttling.ec2': {
+            'rate': 20, 'burst': 40, 'max_retries': 5, 'retry_budget': 50},
+        'inventory.throttling.azure': {
+            'rate': 10, 'burst': 20, 'max_retries': 5, 'retry_budget': 50},
+        'inventory.throttling.skms': {'rate': 5, 'burst': 5, 'max_retries': 3, 'retry_budget': 20},
+
         # terraform options
         'terraform.version': 'latest',
 
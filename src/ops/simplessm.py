@@ -11,13 +11,12 @@
 #!/usr/bin/env python
 
 from botocore.exceptions import ClientError
-import boto3
-import os
+
+from ops import boto3pool
 
 
 class SimpleSSM(object):
     def __init__(self, aws_profile, region_name):
-        self.initial_aws_profile = os.getenv('AWS_PROFILE', None)
         self.aws_profile = aws_profile
         self.region_name = region_name
 
@@ -30,15 +29,7 @@ class SimpleSSM(object):
             raise Exception(
                 'Error while trying to read SSM value for key: %s - %s' %
                 (key, e.response['Error']['Code']))
-        finally:
-            self.release_ssm_client()
 
     def get_ssm_client(self):
-        os.environ['AWS_PROFILE'] = self.aws_profile
-        return boto3.client('ssm', region_name=self.region_name)
-
-    def release_ssm_client(self):
-        if self.initial_aws_profile is None:
-            del os.environ['AWS_PROFILE']
-        else:
-            os.environ['AWS_PROFILE'] = self.initial_aws_profile
+        # the client is shared by all the lookups of the same profile and region
+        return boto3pool.pool.client('ssm', self.aws_profile, self.region_name)
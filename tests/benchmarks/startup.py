@@ -0,0 +1,226 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+"""
+Startup benchmarks of the ops command line
+
+Runs a few commands against the tests/e2e/fixture clusters, offline, each one in
+a new interpreter, and reports for each of them:
+  - cold: the wall time of the first run, with an empty bytecode cache
+  - warm: the median wall time of the next runs
+  - imports: the time spent importing modules, from python -X importtime, and the
+    packages that take most of it
+
+The inventory is generated once before the runs are timed, so the inventory and
+ssh commands read it from the cache.
+
+    python tests/benchmarks/startup.py                # print the report
+    python tests/benchmarks/startup.py --save         # and store it as the baseline
+    python tests/benchmarks/startup.py --compare      # exit with 1 when slower than the baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, '..', '..', 'src')
+FIXTURE_DIR = os.path.join(BENCHMARKS_DIR, '..', 'e2e', 'fixture', 'ansible')
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'startup_baseline.json')
+
+CLUSTER = 'clusters/test.yaml'
+
+SCENARIOS = [
+    ('help', [CLUSTER, 'inventory', '--help']),
+    ('noop', [CLUSTER, 'noop']),
+    ('inventory', [CLUSTER, 'inventory']),
+    ('ssh', [CLUSTER, 'ssh', 'web1']),
+]
+
+# like ops.main.run, without executing the generated command
+DRIVER = """
+import sys
+from ops.main import AppContainer
+
+try:
+    app = AppContainer(sys.argv[1:])
+    if app.console_args.command != 'noop':
+        app.run()
+except SystemExit as e:
+    sys.exit(e.code)
+"""
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \| *(\S+)$')
+
+# the packages listed in the report, by import time
+TOP_PACKAGES = 8
+
+
+def run_ops(argv, env, importtime=False):
+    """ Runs ops with argv in a new interpreter, returns the wall time and the stderr """
+    options = ['-X', 'importtime'] if importtime else []
+    command = [sys.executable] + options + ['-c', DRIVER] + argv
+
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=FIXTURE_DIR, env=env, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    duration = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise Exception("ops %s failed with exit code %d:\n%s" % (
+            ' '.join(argv), process.returncode, process.stderr))
+
+    return duration, process.stderr
+
+
+def parse_importtime(output):
+    """ Returns the total import time, the number of modules imported and the time per top
+    level package """
+    total = 0
+    modules = 0
+    packages = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME.match(line)
+        if not match:
+            continue
+
+        self_us = int(match.group(1))
+        package = match.group(2).split('.')[0]
+        total += self_us
+        modules += 1
+        packages[package] = packages.get(package, 0) + self_us
+
+    top = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:TOP_PACKAGES]
+    return dict(total=round(total / 1e6, 4), modules=modules,
+                packages=dict((name, round(us / 1e6, 4)) for name, us in top))
+
+
+def benchmark(runs):
+    work_dir = tempfile.mkdtemp(prefix='ops-bench')
+    try:
+        env = dict(os.environ)
+        env['HOME'] = os.path.join(work_dir, 'home')
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [os.path.abspath(SRC_DIR), env.get('PYTHONPATH')]))
+        env.pop('REFRESH_CACHE', None)
+        # the warm runs read the bytecode written by the cold one
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        os.mkdir(env['HOME'])
+
+        # generate the inventory and the host index, with bytecode cached apart from the timed runs
+        run_ops(SCENARIOS[-1][1],
+                dict(env, PYTHONPYCACHEPREFIX=os.path.join(work_dir, 'pycache-prime')))
+
+        results = {}
+        for name, argv in SCENARIOS:
+            scenario_env = dict(env, PYTHONPYCACHEPREFIX=os.path.join(work_dir, 'pycache-' + name))
+            cold, _ = run_ops(argv, scenario_env)
+            warm = [run_ops(argv, scenario_env)[0] for _ in range(runs)]
+            _, output = run_ops(argv, scenario_env, importtime=True)
+
+            results[name] = dict(cold=round(cold, 4), warm=round(statistics.median(warm), 4),
+                                 warm_min=round(min(warm), 4), imports=parse_importtime(output))
+
+        return dict(python=platform.python_version(), runs=runs, scenarios=results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_report(result):
+    lines = ['ops startup, python %s, median of %d warm runs' % (result['python'], result['runs']),
+             '',
+             '%-10s %8s %8s %9s %8s  %s' % (
+                 'scenario', 'cold', 'warm', 'imports', 'modules', 'slowest packages')]
+    for name, scenario in result['scenarios'].items():
+        packages = ', '.join('%s %dms' % (package, seconds * 1000)
+                             for package, seconds
+                             in list(scenario['imports']['packages'].items())[:4])
+        lines.append('%-10s %7.3fs %7.3fs %8.3fs %8d  %s' % (
+            name, scenario['cold'], scenario['warm'], scenario['imports']['total'],
+            scenario['imports']['modules'], packages))
+
+    return '\n'.join(lines)
+
+
+def compare(result, baseline, threshold, slack):
+    """ Returns the regressions past the threshold, relative to the baseline """
+
+    def regressed(current, previous, allowed_slack):
+        return current > previous * (1 + threshold) + allowed_slack
+
+    regressions = []
+    for name, scenario in result['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if not previous:
+            continue
+
+        checks = [
+            ('warm time', scenario['warm'], previous['warm'], slack),
+            ('import time', scenario['imports']['total'], previous['imports']['total'], slack),
+            ('imported modules', scenario['imports']['modules'],
+             previous['imports']['modules'], 0),
+        ]
+        for metric, current, before, allowed_slack in checks:
+            if regressed(current, before, allowed_slack):
+                regressions.append('%s: %s went from %s to %s' % (name, metric, before, current))
+
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the startup of the ops commands')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Warm runs of each command (default 5)')
+    parser.add_argument('--save', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Fail when a command got slower than the baseline past the threshold')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='The baseline file (default %(default)s)')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown relative to the baseline (default 0.25, 25%%)')
+    parser.add_argument('--slack', type=float, default=0.05,
+                        help='Allowed slowdown in seconds on top of the threshold, for noise '
+                             '(default 0.05)')
+    parser.add_argument('--output', help='Also write the report to this file')
+    args = parser.parse_args(args)
+
+    result = benchmark(args.runs)
+    report = format_report(result)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.threshold, args.slack)
+        report += '\n\n' + ('\n'.join(['Startup regressions:'] + regressions) if regressions
+                            else 'No startup regression against %s' % args.baseline)
+
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+
+    return 1 if args.compare and regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
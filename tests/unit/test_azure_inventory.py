@@ -0,0 +1,193 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import importlib
+import json
+import time
+from collections import Counter
+from types import SimpleNamespace as Namespace
+
+import pytest
+
+# the plugin package exports the azr function under the module name
+azr = importlib.import_module('ops.inventory.plugin.azr')
+
+
+def resource_id(resource_group, provider, kind, name):
+    return '/subscriptions/sub/resourceGroups/%s/providers/%s/%s/%s' % (
+        resource_group, provider, kind, name)
+
+
+def machine(name, resource_group, nic_resource_group=None, location='westeurope', tags=None):
+    nic_id = resource_id(nic_resource_group or resource_group, 'Microsoft.Network',
+                         'networkInterfaces', name + '-nic')
+    return Namespace(
+        # the API returns the resource group of the machines in upper case
+        id=resource_id(resource_group.upper(), 'Microsoft.Compute', 'virtualMachines', name),
+        name=name, location=location, type='Microsoft.Compute/virtualMachines', tags=tags or {},
+        plan=None, provisioning_state='Succeeded',
+        hardware_profile=Namespace(vm_size='Standard_D2'),
+        os_profile=Namespace(computer_name=name, windows_configuration=None),
+        storage_profile=Namespace(
+            os_disk=Namespace(name=name + '-disk', os_type=Namespace(value='Linux')),
+            image_reference=None),
+        network_profile=Namespace(network_interfaces=[Namespace(id=nic_id)]))
+
+
+def network_interface(machine, private_ip, public_ip=None):
+    nic_id = machine.network_profile.network_interfaces[0].id
+    public_ip_id = None
+    if public_ip:
+        public_ip_id = Namespace(id=resource_id(nic_id.split('/')[4], 'Microsoft.Network',
+                                                'publicIPAddresses', machine.name + '-ip'))
+    return Namespace(id=nic_id, name=machine.name + '-nic', primary=True, mac_address='00-0D',
+                     ip_configurations=[Namespace(private_ip_address=private_ip,
+                                                  private_ip_allocation_method='Static',
+                                                  public_ip_address=public_ip_id)])
+
+
+def public_ip_address(network_interface, ip):
+    return Namespace(id=network_interface.ip_configurations[0].public_ip_address.id, name='ip',
+                     ip_address=ip, public_ip_allocation_method='Static', dns_settings=None)
+
+
+class FakeOperations(object):
+    def __init__(self, resources, calls, delay=0):
+        self.resources = resources
+        self.calls = calls
+        self.delay = delay
+
+    def resource_group(self, resource):
+        return resource.id.split('/')[4].lower()
+
+    def list(self, resource_group):
+        self.calls['list'] += 1
+        time.sleep(self.delay)
+        return [r for r in self.resources if self.resource_group(r) == resource_group.lower()]
+
+    def list_all(self):
+        self.calls['list_all'] += 1
+        return list(self.resources)
+
+    def get(self, resource_group, name, expand=None):
+        self.calls['get'] += 1
+        resource = next(r for r in self.resources if r.id.lower().endswith('/' + name.lower()))
+        if expand:
+            return Namespace(instance_view=Namespace(statuses=[
+                Namespace(code='ProvisioningState/succeeded'),
+                Namespace(code='PowerState/running')]))
+        return resource
+
+
+class FakeAzureRM(object):
+    def __init__(self, machines, network_interfaces, public_ip_addresses, subscription_id='sub'):
+        self.subscription_id = subscription_id
+        self.subscriptions = {}
+        self.calls = dict((kind, Counter()) for kind in ('machines', 'nics', 'ips'))
+        self.compute_client = Namespace(
+            virtual_machines=FakeOperations(machines, self.calls['machines']))
+        self.network_client = Namespace(
+            network_interfaces=FakeOperations(network_interfaces, self.calls['nics']),
+            public_ip_addresses=FakeOperations(public_ip_addresses, self.calls['ips']))
+        self.rm_client = Namespace()
+
+    def for_subscription(self, subscription_id):
+        return self.subscriptions.get(subscription_id, self)
+
+
+@pytest.fixture
+def azure(monkeypatch):
+    bastion = machine('bastion', 'rg1', tags={'role': 'bastion'})
+    web1 = machine('web1', 'rg1', tags={'role': 'web'})
+    web2 = machine('web2', 'rg2', nic_resource_group='shared', tags={'role': 'web'})
+    machines = [bastion, web1, web2]
+    nics = [network_interface(bastion, '10.0.0.1', '1.2.3.4'), network_interface(web1, '10.0.0.2'),
+            network_interface(web2, '10.0.0.3')]
+    ips = [public_ip_address(nics[0], '1.2.3.4')]
+
+    rm = FakeAzureRM(machines, nics, ips)
+    monkeypatch.setattr(azr, 'AzureRM', lambda args: rm)
+    return rm
+
+
+def test_machines_are_joined_with_listed_resources(azure):
+    result = json.loads(azr.azr(dict(tags='role')))
+
+    hostvars = result['_meta']['hostvars']
+    assert result['azure'] == ['bastion', 'web1', 'web2']
+    assert hostvars['bastion']['ansible_ssh_host'] == '1.2.3.4'
+    assert hostvars['web2']['ansible_ssh_host'] == '1.2.3.4--10.0.0.3'
+    assert hostvars['web1']['powerstate'] == 'running'
+    assert hostvars['web1']['network_interface'] == 'web1-nic'
+    # the resource groups of the network interfaces and IPs are listed, the instance views
+    # are fetched one by one
+    assert azure.calls['nics'] == Counter(list=2)
+    assert azure.calls['ips'] == Counter(list=1)
+    assert azure.calls['machines'] == Counter(list_all=1, get=3)
+
+
+def test_single_host_lists_only_its_resource_groups(azure):
+    result = json.loads(azr.azr(dict(host='web2', no_powerstate=True)))
+
+    assert result['azure'] == ['web2']
+    assert azure.calls['nics'] == Counter(list=1)
+    assert azure.calls['ips'] == Counter()
+
+
+def test_resources_are_listed_per_resource_group(azure):
+    result = json.loads(azr.azr(dict(resource_groups='rg1,rg2', no_powerstate=True)))
+
+    assert result['azure'] == ['bastion', 'web1', 'web2']
+    assert result['_meta']['hostvars']['web2']['private_ip'] == '10.0.0.3'
+    # rg1 and shared for the network interfaces, the public IP is in rg1
+    assert azure.calls['nics'] == Counter(list=2)
+    assert azure.calls['ips'] == Counter(list=1)
+    assert azure.calls['machines'] == Counter(list=2)
+
+
+def test_subscriptions_and_resource_groups_are_merged_in_order(azure):
+    other = machine('web3', 'rg1', location='northeurope', tags={'role': 'web'})
+    other_bastion = machine('bastion2', 'rg2', location='northeurope', tags={'role': 'bastion'})
+    nics = [network_interface(other, '10.1.0.3'),
+            network_interface(other_bastion, '10.1.0.1', '5.6.7.8')]
+    azure.subscriptions['other'] = FakeAzureRM([other, other_bastion], nics,
+                                               [public_ip_address(nics[1], '5.6.7.8')],
+                                               subscription_id='other')
+    # the first fetch is the slowest one, the result must not depend on it
+    azure.compute_client.virtual_machines.delay = 0.2
+
+    result = json.loads(azr.azr(dict(subscription_id=['sub', 'other'],
+                                     resource_groups=['rg1', 'rg2'], no_powerstate=True)))
+
+    hostvars = result['_meta']['hostvars']
+    assert result['azure'] == ['bastion', 'web1', 'web2', 'web3', 'bastion2']
+    assert hostvars['web3']['subscription_id'] == 'other'
+    # each location goes through its own bastion
+    assert hostvars['web2']['ansible_ssh_host'] == '1.2.3.4--10.0.0.3'
+    assert hostvars['web3']['ansible_ssh_host'] == '5.6.7.8--10.1.0.3'
+
+
+@pytest.mark.parametrize('args, max_workers', [
+    ({}, azr.POWERSTATE_CONCURRENCY),
+    ({'concurrency': 32}, 32),
+])
+def test_fetches_are_bounded_by_default(azure, monkeypatch, args, max_workers):
+    pools = []
+    thread_pool_executor = azr.ThreadPoolExecutor
+
+    def thread_pool(max_workers):
+        pools.append(max_workers)
+        return thread_pool_executor(max_workers=max_workers)
+
+    monkeypatch.setattr(azr, 'ThreadPoolExecutor', thread_pool)
+    resource_groups = ['rg%d' % i for i in range(12)]
+    azr.azr(dict(args, resource_groups=resource_groups, no_powerstate=True))
+
+    assert pools == [max_workers, max_workers]
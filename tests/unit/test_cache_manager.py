@@ -0,0 +1,148 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import os
+import time
+
+from ops.inventory import caching, sqliteindex
+from ops.inventory.cachemanager import InventoryCacheManager
+from ops.inventory.generator import CachedInventoryGenerator
+
+
+def generated_dir(cache_dir, name, age, size=0):
+    path = cache_dir.mkdir(name)
+    path.mkdir('inventory').join('hosts').write('x' * size)
+    mtime = time.time() - age
+    os.utime(str(path), (mtime, mtime))
+    return str(path)
+
+
+def cache_entry(cache_dir, name, inventory_dir, age=0):
+    path = str(cache_dir.join(name))
+    caching.write(path, dict(inventory_path=inventory_dir + '/inventory', ssh_config_path={},
+                             errors=[]))
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def cache_manager(cache_dir, **config):
+    ops_config = {'cache.dir': str(cache_dir), 'inventory.max_age': 600,
+                  'cache.gc.max_age': 86400, 'cache.gc.max_size': 0, 'cache.gc.interval': 3600}
+    ops_config.update(config)
+    return InventoryCacheManager(ops_config)
+
+
+def test_unused_dirs_are_removed_by_age(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    used = generated_dir(cache_dir, 'inventory_used', 2 * 86400)
+    expired = generated_dir(cache_dir, 'inventory_expired', 2 * 86400)
+    unused = generated_dir(cache_dir, 'inventory_unused', 2 * 86400)
+    recent = generated_dir(cache_dir, 'inventory_recent', 3600)
+    cache_entry(cache_dir, 'location-' + 'a' * 32, used)
+    cache_entry(cache_dir, 'location-' + 'b' * 32, expired, age=7200)
+    # plugin caches and lock files are not inventory cache entries, and are not read
+    caching.write(str(cache_dir.join('c' * 32)), {'inventory_path': expired + '/inventory'})
+    cache_dir.join('location-' + 'a' * 32 + '.lock').write('')
+
+    result = cache_manager(cache_dir).collect()
+
+    assert result['removed'] == 2
+    assert os.path.isdir(used) and os.path.isdir(recent)
+    assert not os.path.exists(expired) and not os.path.exists(unused)
+    assert os.path.isfile(str(cache_dir.join('c' * 32)))
+
+
+def test_oldest_unused_dirs_are_removed_over_the_size_budget(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    used = generated_dir(cache_dir, 'inventory_used', 7200, size=1000)
+    oldest = generated_dir(cache_dir, 'inventory_oldest', 5000, size=1000)
+    older = generated_dir(cache_dir, 'inventory_older', 4000, size=1000)
+    new = generated_dir(cache_dir, 'inventory_new', 3000, size=1000)
+    # the dir being generated right now is never removed
+    generating = generated_dir(cache_dir, 'inventory_generating', 0, size=1000)
+    cache_entry(cache_dir, 'location-' + 'a' * 32, used)
+
+    result = cache_manager(cache_dir, **{'cache.gc.max_size': 3500}).collect()
+
+    assert result['removed'] == 2
+    assert result['freed'] >= 2000
+    assert not os.path.exists(oldest) and not os.path.exists(older)
+    assert os.path.isdir(new) and os.path.isdir(used) and os.path.isdir(generating)
+
+
+def test_recent_dirs_are_kept_over_the_size_budget(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    old = generated_dir(cache_dir, 'inventory_old', 7 * 3600, size=1000)
+    # an uncached inventory a running command may still use
+    running = generated_dir(cache_dir, 'inventory_running', 3600, size=1000)
+
+    result = cache_manager(cache_dir, **{'cache.gc.max_size': 500,
+                                         'cache.gc.min_age': 6 * 3600}).collect()
+
+    assert result['removed'] == 1
+    assert not os.path.exists(old) and os.path.isdir(running)
+
+
+class FakeInventoryGenerator(object):
+    errors = []
+
+    def __init__(self, inventory_dir):
+        self.inventory_dir = inventory_dir
+
+    def generate(self):
+        return self.inventory_dir + '/inventory', {}
+
+
+def test_entries_at_a_custom_location_are_referenced(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    used = generated_dir(cache_dir, 'inventory_used', 2 * 86400)
+    cluster_config = dict(inventory=[dict(plugin='test')],
+                          inventory_settings=dict(location=str(tmpdir.join('custom', 'cache'))))
+    ops_config = {'cache.dir': str(cache_dir), 'inventory.max_age': 600}
+    CachedInventoryGenerator(FakeInventoryGenerator(used), cluster_config, ops_config).generate()
+
+    result = cache_manager(cache_dir).collect()
+
+    assert result['removed'] == 0 and result['referenced'] == 1
+    assert os.path.isdir(used)
+
+
+def test_removed_dirs_are_dropped_from_the_sqlite_index(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    unused = generated_dir(cache_dir, 'inventory_unused', 2 * 86400)
+    sqlite_path = str(cache_dir.join('inventory.sqlite'))
+    sqliteindex.update(sqlite_path, 'test', unused + '/inventory',
+                       dict(groups={'all': ['web1']}, hosts={'web1': {}}))
+
+    cache_manager(cache_dir).collect()
+
+    assert sqliteindex.SqliteIndex.open(sqlite_path, unused + '/inventory') is None
+
+
+def test_many_dirs_are_dropped_from_the_sqlite_index_in_batches(tmpdir):
+    sqlite_path = str(tmpdir.join('inventory.sqlite'))
+    sqliteindex.update(sqlite_path, 'test', '/cache/inventory_1/inventory',
+                       dict(groups={'all': ['web1']}, hosts={'web1': {}}))
+
+    sqliteindex.remove(sqlite_path, ['/cache/inventory_%d/inventory' % i for i in range(40000)])
+
+    assert sqliteindex.SqliteIndex.open(sqlite_path, '/cache/inventory_1/inventory') is None
+
+
+def test_collection_runs_once_per_interval(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    generated_dir(cache_dir, 'inventory_unused', 2 * 86400)
+
+    assert cache_manager(cache_dir).collect_if_due()['removed'] == 1
+
+    generated_dir(cache_dir, 'inventory_unused_again', 2 * 86400)
+    assert cache_manager(cache_dir).collect_if_due() is None
+    assert cache_manager(cache_dir, **{'cache.gc.interval': 0}).collect_if_due() is None
+    assert os.listdir(str(cache_dir)).count('inventory_unused_again') == 1
@@ -0,0 +1,247 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import fnmatch
+import json
+import time
+
+import pytest
+
+from ops import boto3pool
+from ops.inventory.ec2inventory import Ec2Inventory
+from ops.inventory.plugin.cns import cns, merge_inventories
+
+
+def instance(instance_id, name, private_ip, public_ip=None, role='web', cluster='test',
+             state='running'):
+    return {
+        'InstanceId': instance_id,
+        'State': {'Name': state, 'Code': 16},
+        'PrivateIpAddress': private_ip,
+        'PublicIpAddress': public_ip,
+        'Placement': {'AvailabilityZone': 'us-east-1a'},
+        'Tags': [{'Key': 'Name', 'Value': name},
+                 {'Key': 'role', 'Value': role},
+                 {'Key': 'cluster', 'Value': cluster}],
+        'BlockDeviceMappings': [{'DeviceName': '/dev/xvda'}],
+    }
+
+
+class FakeEc2Client(object):
+    def __init__(self, region, instances, delay=0):
+        self.region = region
+        self.instances = instances
+        self.delay = delay
+        self.calls = []
+
+    def describe_instances(self, Filters):
+        self.calls.append(Filters)
+        time.sleep(self.delay)
+        instances = [i for i in self.instances if self.matches(i, Filters)]
+        return {'Reservations': [{'Instances': instances}]}
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Filters, page_size=2):
+        instances = self.describe_instances(Filters)['Reservations'][0]['Instances']
+        for start in range(0, len(instances), page_size):
+            yield {'Reservations': [{'Instances': instances[start:start + page_size]}]}
+
+    @staticmethod
+    def matches(instance, filters):
+        tags = dict((tag['Key'], tag['Value']) for tag in instance['Tags'])
+        for f in filters:
+            if f['Name'] == 'instance-state-name':
+                value = instance['State']['Name']
+            else:
+                value = tags.get(f['Name'].replace('tag:', ''))
+            # tag filter values accept * and ? wildcards
+            if not any(fnmatch.fnmatchcase(value or '', pattern) for pattern in f['Values']):
+                return False
+        return True
+
+
+class FakeSession(object):
+    def __init__(self, clients):
+        self.clients = clients
+
+    def client(self, service, region_name, config=None):
+        return self.clients[region_name]
+
+
+@pytest.fixture
+def ec2_clients(monkeypatch):
+    clients = {}
+    monkeypatch.setattr(boto3pool, 'pool', boto3pool.Boto3Pool())
+    monkeypatch.setattr(boto3pool.boto3, 'Session', lambda profile_name: FakeSession(clients))
+    return clients
+
+
+def test_regions_are_merged_in_order(ec2_clients):
+    # the first region is the slowest one, the result must not depend on it
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        instance('i-0002', 'app', '10.0.0.2'),
+        instance('i-0001', 'app', '10.0.0.1'),
+        instance('i-0009', 'bastion', '10.0.0.9', '1.2.3.4', role='bastion'),
+    ], delay=0.2)
+    ec2_clients['us-west-2'] = FakeEc2Client('us-west-2', [
+        instance('i-0003', 'app', '10.1.0.3'),
+    ])
+
+    bastion_filters = [{'Name': 'tag:role', 'Values': ['bastion']}]
+    inventory = Ec2Inventory('profile', 'us-east-1,us-west-2', bastion_filters=bastion_filters)
+    result = json.loads(inventory.get_as_json())
+
+    assert result['web'] == ['app', 'app-0002', 'app-0003']
+    assert result['us-west-2'] == ['app-0003']
+    assert result['_meta']['hostvars']['app']['ansible_ssh_host'] == '1.2.3.4--10.0.0.1'
+    assert result['_meta']['hostvars']['app-0003']['ansible_ssh_host'] == '10.1.0.3'
+    # the running state filter is not appended to the configured bastion filters
+    assert bastion_filters == [{'Name': 'tag:role', 'Values': ['bastion']}]
+
+
+def test_all_pages_are_fetched_with_server_side_filters(ec2_clients):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        instance('i-%04d' % i, 'app', '10.0.0.%d' % i) for i in range(5)
+    ] + [instance('i-0099', 'stopped', '10.0.0.99', state='stopped')])
+
+    inventory = Ec2Inventory('profile', 'us-east-1', filters={'tag:role': 'web'})
+    result = json.loads(inventory.get_as_json())
+
+    assert len(result['web']) == 5
+    assert 'stopped' not in result['_meta']['hostvars']
+    assert ec2_clients['us-east-1'].calls[0] == [
+        {'Name': 'tag:role', 'Values': ['web']},
+        {'Name': 'instance-state-name', 'Values': ['running']}]
+
+    instances = inventory.get_instances(ec2_clients['us-east-1'])
+    assert [i['InstanceId'] for i in instances] == ['i-%04d' % i for i in range(5)]
+    assert 'BlockDeviceMappings' not in instances[0]
+
+
+def test_merge_inventories_dedupes_groups():
+    result = {}
+    merge_inventories(result, {'web': ['a', 'b'],
+                               'db': {'hosts': ['c'], 'children': ['db_primary']},
+                               '_meta': {'hostvars': {'a': {}, 'b': {}}}})
+    merge_inventories(result, {'web': ['b', 'd'],
+                               'db': {'hosts': ['e', 'c'], 'children': ['db_replica']},
+                               'app': {'children': ['web']}, '_meta': {'hostvars': {'d': {}}}})
+    merge_inventories(result, {'app': ['f']})
+
+    result = json.loads(json.dumps(result, default=list))
+    assert result['web'] == ['a', 'b', 'd']
+    assert result['db'] == {'hosts': ['c', 'e'], 'children': ['db_primary', 'db_replica']}
+    assert result['app'] == {'hosts': ['f'], 'children': ['web']}
+    assert sorted(result['_meta']['hostvars']) == ['a', 'b', 'd']
+
+
+def test_cns_batches_cluster_names(ec2_clients):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        instance('i-0001', 'web1', '10.0.0.1', cluster='one'),
+        instance('i-0002', 'web1', '10.0.1.1', cluster='two'),
+        instance('i-0003', 'bastion1', '10.0.0.9', '1.1.1.1', role='bastion', cluster='one'),
+        instance('i-0004', 'bastion1', '10.0.1.9', '2.2.2.2', role='bastion', cluster='two'),
+        instance('i-0005', 'web1', '10.0.2.1', cluster='three'),
+    ])
+
+    result = json.loads(cns(dict(clusters=[
+        dict(region='us-east-1', boto_profile='profile', names=['one', 'two'])])))
+
+    # one instances query and one bastion query for both names
+    assert len(ec2_clients['us-east-1'].calls) == 2
+    assert ec2_clients['us-east-1'].calls[0][0] == {
+        'Name': 'tag:cluster', 'Values': ['one', 'two']}
+    # names are not deduplicated across clusters, each cluster keeps its bastion
+    assert result['one'] == ['bastion1', 'web1']
+    assert result['_meta']['hostvars']['web1']['ansible_ssh_host'] == '2.2.2.2--10.0.1.1'
+    assert 'three' not in result
+
+
+def test_cns_queries_wildcard_names_on_their_own(ec2_clients):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        instance('i-0001', 'web1', '10.0.0.1', cluster='prod-a'),
+        instance('i-0002', 'web2', '10.0.1.1', cluster='prod-b'),
+        instance('i-0003', 'web3', '10.0.2.1', cluster='stage'),
+        instance('i-0004', 'bastion1', '10.0.0.9', '1.1.1.1', role='bastion', cluster='prod-a'),
+    ])
+
+    result = json.loads(cns(dict(clusters=[
+        dict(region='us-east-1', boto_profile='profile', names=['stage', 'prod-*'])])))
+
+    assert result['prod-a'] == ['bastion1', 'web1']
+    assert result['prod-b'] == ['web2']
+    assert result['stage'] == ['web3']
+    # one batch for the plain names, one query for the pattern, each with its bastion query
+    assert len(ec2_clients['us-east-1'].calls) == 4
+    assert result['_meta']['hostvars']['web2']['ansible_ssh_host'] == '1.1.1.1--10.0.1.1'
+
+
+def test_cns_warms_up_a_client_per_region(ec2_clients, monkeypatch):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        instance('i-0001', 'web1', '10.0.0.1', cluster='one')])
+    ec2_clients['us-west-2'] = FakeEc2Client('us-west-2', [])
+    warmed_up = []
+    monkeypatch.setattr(boto3pool.pool, 'warm_up', warmed_up.extend)
+
+    cns(dict(clusters=[dict(region='us-east-1,us-west-2', boto_profile='profile', names=['one'])]))
+
+    assert warmed_up == [('profile', 'us-east-1', 'ec2'), ('profile', 'us-west-2', 'ec2')]
+
+
+def test_boto3_clients_are_shared(ec2_clients):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [instance('i-0001', 'app', '10.0.0.1')])
+    ec2_clients['us-west-2'] = FakeEc2Client('us-west-2', [])
+
+    boto3pool.pool.warm_up([('profile', 'us-east-1', 'ec2')], background=False)
+    Ec2Inventory('profile', 'us-east-1,us-west-2').get_as_json()
+    Ec2Inventory('profile', 'us-east-1').get_as_json()
+
+    assert boto3pool.pool.client('ec2', 'profile', 'us-east-1') is ec2_clients['us-east-1']
+    assert boto3pool.pool.stats() == dict(hits=3, misses=2, sessions=1, clients=2)
+
+
+def test_hostvars_are_projected(ec2_clients):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        dict(instance('i-0001', 'app', '10.0.0.1', '1.2.3.4'), ImageId='ami-1', KeyName='key')])
+
+    hostvars = dict(include=['ec2_tag_*', 'ec2_InstanceId', 'ec2_state'], exclude=['ec2_tag_Name'])
+    result = json.loads(cns(dict(hostvars=hostvars, clusters=[
+        dict(region='us-east-1', boto_profile='profile', names=['test'])])))
+
+    assert result['_meta']['hostvars']['app'] == {
+        'ec2_InstanceId': 'i-0001', 'ec2_state': 'running', 'ec2_tag_role': 'web',
+        'ec2_tag_cluster': 'test',
+        'ansible_ssh_host': '1.2.3.4', 'private_ip': '10.0.0.1', 'private_ip_address': '10.0.0.1'}
+    # the grouping still sees every tag
+    assert result['web'] == ['app']
+
+    inventory = Ec2Inventory('profile', 'us-east-1',
+                             hostvars=dict(exclude=['ec2_ImageId', 'ec2_placement']))
+    compact = inventory.get_instances(ec2_clients['us-east-1'])[0]
+    assert 'ImageId' not in compact and compact['KeyName'] == 'key'
+    hostvars = inventory.get_host_info_dict_from_instance(compact)
+    assert 'ec2_placement' not in hostvars and hostvars['ec2_KeyName'] == 'key'
+
+
+def test_tag_grouping_is_configurable(ec2_clients):
+    ec2_clients['us-east-1'] = FakeEc2Client('us-east-1', [
+        instance('i-0001', 'app', '10.0.0.1', '1.2.3.4'),
+        instance('i-0002', 'db', '10.0.0.2', role='db:primary')])
+
+    groups = dict(tags=['role', 'clu*'], prefix='tag_{key}_', ip=False)
+    result = json.loads(Ec2Inventory('profile', 'us-east-1', groups=groups).get_as_json())
+
+    assert result['tag_role_web'] == ['app']
+    assert result['tag_role_db_primary'] == ['db']
+    assert result['tag_cluster_test'] == ['app', 'db']
+    assert sorted(group for group in result if group != '_meta') == [
+        'tag_cluster_test', 'tag_role_db_primary', 'tag_role_web', 'us-east-1', 'us-east-1a']
@@ -0,0 +1,150 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import os
+
+import pytest
+from ansible.inventory.manager import InventoryManager
+from ansible.parsing.dataloader import DataLoader
+
+from ops.inventory.generator import InventoryGenerator, PluginInventoryGenerator
+from ops.inventory.hostindex import HostIndex
+
+
+def plugin(args):
+    return {
+        'mycluster': ['web1.host', 'web2.host', 'db1.host', 'bastion.host'],
+        'web': ['web1.host', 'web2.host'],
+        'db': {'hosts': ['db1.host'], 'children': ['replica']},
+        'replica': ['db2.host'],
+        'bastion': ['bastion.host'],
+        '_meta': {'hostvars': {
+            'web1.host': {'ansible_ssh_host': '1.2.3.4--10.0.0.1', 'other': 'value'},
+            'bastion.host': {'ansible_ssh_host': '1.2.3.4'},
+        }}
+    }
+
+
+class FakeInventoryGenerator(object):
+    def __init__(self, inventory_path):
+        self.inventory_path = inventory_path
+
+    def generate(self):
+        return self.inventory_path, {'ssh.config': '/tmp/ssh.config'}
+
+
+class FakeAnsibleInventory(object):
+    def __init__(self, inventory_path):
+        self.loads = 0
+        self.inventory = InventoryManager(loader=DataLoader(), sources=[inventory_path])
+
+    def get_hosts(self, pattern):
+        return self.inventory.get_hosts(pattern)
+
+
+def generate_inventory(tmpdir):
+    inventory_path = str(tmpdir.mkdir('inventory'))
+    PluginInventoryGenerator('test', [plugin], {}).generate(inventory_path, dict(plugin='plugin'))
+    return inventory_path
+
+
+def create_host_index(inventory_path, ops_config):
+    ansible_inventory = FakeAnsibleInventory(inventory_path)
+
+    def ansible_inventory_factory():
+        ansible_inventory.loads += 1
+        return ansible_inventory
+
+    index = HostIndex(FakeInventoryGenerator(inventory_path), ansible_inventory_factory,
+                      ops_config)
+    return index, ansible_inventory
+
+
+@pytest.fixture
+def host_index(tmpdir):
+    return create_host_index(generate_inventory(tmpdir), {'cache.format': 'json'})
+
+
+@pytest.fixture
+def sqlite_host_index(tmpdir):
+    inventory_path = generate_inventory(tmpdir)
+    ops_config = {'cache.dir': str(tmpdir.join('cache')), 'inventory.sqlite_index': True}
+    generator = InventoryGenerator(dict(cluster='test', inventory=[]), None, ops_config)
+    generator.index_inventory(inventory_path)
+
+    return create_host_index(inventory_path, ops_config)
+
+
+PATTERNS = ['web', 'mycluster,&web', 'mycluster,&missing', 'db', 'all,!web', 'web,db,!replica',
+            'web[0]', 'web[-1]', 'mycluster[1:2]', 'mycluster[2:]', 'web1.host', 'missing',
+            'web*', '*.host,!db*', 'db?.host', 'web*[3]', 'mycluster,&*1.host']
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_patterns_match_ansible(host_index, pattern):
+    index, ansible_inventory = host_index
+
+    assert index.match(pattern) == [host.name for host in ansible_inventory.get_hosts(pattern)]
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_sqlite_patterns_match_ansible(sqlite_host_index, pattern):
+    index, ansible_inventory = sqlite_host_index
+
+    assert index.match(pattern) == [host.name for host in ansible_inventory.get_hosts(pattern)]
+    assert ansible_inventory.loads == 0
+
+
+def test_sqlite_index_keeps_the_groups_of_hosts(sqlite_host_index):
+    index, ansible_inventory = sqlite_host_index
+
+    host = index.get_host('db2.host')
+    assert sorted(group.name for group in host.get_groups()) == ['all', 'db', 'replica']
+    assert index.get_host('web1.host').vars == {'ansible_ssh_host': '1.2.3.4--10.0.0.1'}
+
+
+def test_index_is_written_once_and_reused(host_index):
+    index, ansible_inventory = host_index
+
+    hosts = index.get_hosts('mycluster,&web')
+    assert [(host.name, host.vars) for host in hosts] == [
+        ('web1.host', {'ansible_ssh_host': '1.2.3.4--10.0.0.1'}), ('web2.host', {})]
+    assert os.path.isfile(index.index_path)
+    assert ansible_inventory.loads == 1
+
+    again = HostIndex(FakeInventoryGenerator(index.generated_path), None, {})
+    assert again.get_host('bastion.host').vars['ansible_ssh_host'] == '1.2.3.4'
+    assert again.get_ssh_config() == '/tmp/ssh.config'
+
+
+class FakeSshConfigGenerator(object):
+    def generate(self, directory):
+        return {}
+
+
+def test_index_is_written_when_the_inventory_is_generated(tmpdir):
+    ops_config = {'cache.dir': str(tmpdir), 'cache.gc.interval': 0}
+    generator = InventoryGenerator(dict(cluster='test', inventory=[dict(plugin='plugin')]),
+                                   FakeSshConfigGenerator(), ops_config,
+                                   [PluginInventoryGenerator('test', [plugin], ops_config)])
+    inventory_path, _ = generator.generate()
+
+    index, ansible_inventory = create_host_index(inventory_path, ops_config)
+
+    assert index.match('mycluster,&web') == ['web1.host', 'web2.host']
+    assert ansible_inventory.loads == 0
+
+
+def test_unsupported_patterns_use_ansible(host_index):
+    index, ansible_inventory = host_index
+
+    assert index.match('~web[0-9]') is None
+    assert index.match('web[5]') is None
+    assert [host.name for host in index.get_hosts('~web[0-9]')] == ['web1.host', 'web2.host']
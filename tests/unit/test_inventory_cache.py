@@ -0,0 +1,173 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import json
+import os
+import time
+
+import pytest
+
+from ops.inventory import caching
+from ops.inventory.generator import CachedInventoryGenerator, PluginInventoryGenerator
+
+
+class FakeInventoryGenerator(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = []
+
+    def generate(self):
+        self.calls += 1
+        return '/tmp/inventory%d/inventory' % self.calls, {}
+
+    @staticmethod
+    def display_errors(errors):
+        pass
+
+
+def cached_generator(tmpdir, **config):
+    ops_config = {'cache.dir': str(tmpdir), 'inventory.max_age': 60}
+    ops_config.update(config)
+    cluster_config = {'inventory': [{'plugin': 'test_plugin'}]}
+
+    return CachedInventoryGenerator(FakeInventoryGenerator(), cluster_config, ops_config)
+
+
+def age_cache(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_write_replaces_cache_atomically(tmpdir):
+    path = str(tmpdir.join('cache'))
+    caching.write(path, dict(value=1))
+    caching.write(path, dict(value=2))
+
+    assert caching.read(path) == dict(value=2)
+    assert os.listdir(str(tmpdir)) == ['cache']
+
+
+@pytest.mark.parametrize('name', ['json', 'json.zlib', 'msgpack'])
+def test_serializers_round_trip(tmpdir, monkeypatch, name):
+    if name == 'msgpack' and not caching.HAS_MSGPACK:
+        pytest.skip('msgpack is not installed')
+
+    data = dict(inventory='{"web": ["web1"]}', hosts=['a', 'b'], count=2)
+    path = str(tmpdir.join('cache'))
+    caching.write(path, data, caching.get_serializer(name))
+    assert caching.read(path) == data
+
+    # large caches are memory mapped
+    monkeypatch.setattr(caching, 'MMAP_MIN_SIZE', 0)
+    assert caching.read(path) == data
+
+
+def test_pretty_json_caches_are_still_read(tmpdir):
+    path = tmpdir.join('cache')
+    path.write(json.dumps(dict(value=1), sort_keys=True, indent=2))
+
+    assert caching.read(str(path)) == dict(value=1)
+    assert caching.get_serializer('auto').name == \
+        ('msgpack' if caching.HAS_MSGPACK else 'json.zlib')
+    with pytest.raises(Exception):
+        caching.get_serializer('yaml')
+
+
+def test_expired_cache_is_rebuilt(tmpdir, monkeypatch):
+    monkeypatch.delenv('REFRESH_CACHE', raising=False)
+    generator = cached_generator(tmpdir)
+    generator.generate()
+    age_cache(generator.cache_location, 120)
+
+    inventory_path, _ = generator.generate()
+
+    assert inventory_path == '/tmp/inventory2/inventory'
+
+
+def test_stale_cache_is_served_while_revalidating(tmpdir, monkeypatch):
+    monkeypatch.delenv('REFRESH_CACHE', raising=False)
+    generator = cached_generator(tmpdir, **{'inventory.stale_while_revalidate': 300})
+    refreshes = []
+    monkeypatch.setattr(generator, '_refresh_in_background', lambda: refreshes.append(True))
+    generator.generate()
+    age_cache(generator.cache_location, 120)
+
+    inventory_path, _ = generator.generate()
+
+    assert inventory_path == '/tmp/inventory1/inventory'
+    assert refreshes == [True]
+
+    # past the grace window the user waits for a rebuild again
+    age_cache(generator.cache_location, 400)
+    inventory_path, _ = generator.generate()
+
+    assert inventory_path == '/tmp/inventory2/inventory'
+    assert refreshes == [True]
+
+
+def test_lock_is_exclusive(tmpdir):
+    path = str(tmpdir.join('cache'))
+    with caching.lock(path) as acquired:
+        assert acquired
+        with caching.lock(path, blocking=False) as acquired_again:
+            assert not acquired_again
+
+    with caching.lock(path, blocking=False) as acquired:
+        assert acquired
+
+
+def test_cache_rebuilt_while_waiting_for_lock_is_reused(tmpdir, monkeypatch):
+    monkeypatch.delenv('REFRESH_CACHE', raising=False)
+    generator = cached_generator(tmpdir)
+
+    # simulate another process finishing a rebuild while we wait for the lock
+    real_lock = caching.lock
+
+    def lock_after_rebuild(path, blocking=True):
+        caching.write(path, dict(inventory_path='/tmp/other/inventory', ssh_config_path={},
+                                 errors=[]))
+        os.utime(path, (time.time() + 1, time.time() + 1))
+        return real_lock(path, blocking)
+
+    monkeypatch.setattr(caching, 'lock', lock_after_rebuild)
+
+    inventory_path, _ = generator.generate()
+
+    assert inventory_path == '/tmp/other/inventory'
+    assert generator.inventory_generator.calls == 0
+
+
+def test_plugin_entry_cached_with_its_own_max_age(tmpdir, monkeypatch):
+    monkeypatch.delenv('REFRESH_CACHE', raising=False)
+    calls = []
+
+    def counting_plugin(args):
+        calls.append(args)
+        return '{"web": ["web1.host"]}'
+
+    generator = PluginInventoryGenerator('test', [counting_plugin],
+                                         {'cache.dir': str(tmpdir.join('cache'))})
+    dest = tmpdir.mkdir('inventory')
+
+    def entry(region, **config):
+        return dict(plugin='counting_plugin', args=dict(region=region), **config)
+
+    generator.generate(str(dest), entry('us-east-1'))
+    generator.generate(str(dest), entry('us-east-1', max_age=60))
+    generator.generate(str(dest), entry('us-east-1', max_age=60))
+    assert len(calls) == 2
+
+    # other args are cached separately
+    generator.generate(str(dest), entry('us-west-2', max_age=60))
+    assert len(calls) == 3
+
+    monkeypatch.setenv('REFRESH_CACHE', 'True')
+    generator.generate(str(dest), entry('us-east-1', max_age=60))
+    assert len(calls) == 4
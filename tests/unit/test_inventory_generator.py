@@ -0,0 +1,270 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import errno
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+from ops import OpsException
+from ops.inventory import caching
+from ops.inventory.generator import DirInventoryGenerator, InventoryGenerator, \
+    PluginInventoryGenerator, ShellInventoryGenerator
+
+
+class FakeSshConfigGenerator(object):
+    def generate(self, directory):
+        return {}
+
+
+def slow_plugin(args):
+    time.sleep(args['sleep'])
+    return '{"%s": ["%s.host"]}' % (args['name'], args['name'])
+
+
+def concurrent_plugin(args):
+    # every entry waits for the others, the barrier breaks unless they all run at once
+    args['barrier'].wait()
+    return slow_plugin(dict(args, sleep=0))
+
+
+def broken_plugin(args):
+    return args['missing']
+
+
+def inventory_generator(tmpdir, entries):
+    ops_config = {'cache.dir': str(tmpdir), 'inventory.concurrency': 4}
+    plugins = PluginInventoryGenerator('test', [slow_plugin, concurrent_plugin, broken_plugin],
+                                       ops_config)
+
+    return InventoryGenerator(dict(cluster='test', inventory=entries), FakeSshConfigGenerator(),
+                              ops_config, [plugins])
+
+
+def test_entries_run_concurrently_in_stable_order(tmpdir):
+    barrier = threading.Barrier(4, timeout=5)
+    entries = [dict(plugin='concurrent_plugin', args=dict(name='web%d' % i, barrier=barrier))
+               for i in range(4)]
+    entries.insert(1, dict(plugin='broken_plugin'))
+    entries.append(dict(plugin='broken_plugin', args=dict(other=True)))
+    generator = inventory_generator(tmpdir, entries)
+
+    inventory_path, _ = generator.generate()
+
+    assert sorted(os.listdir(inventory_path)) == ['test-%03d.json' % i for i in (0, 2, 3, 4)]
+    with open(os.path.join(inventory_path, 'test-002.json')) as f:
+        assert 'web1.host' in f.read()
+    assert [error['entry'] for error in generator.errors] == [entries[1], entries[5]]
+
+
+def test_plugin_output_is_loaded_by_ansible_as_a_static_file(tmpdir):
+    from ansible.inventory.manager import InventoryManager
+    from ansible.parsing.dataloader import DataLoader
+
+    output = {
+        'web': ['web1', 'web2'],
+        'db': {'hosts': ['db1'], 'vars': {'port': 5432}},
+        'prod': {'children': ['web', 'db']},
+        '_meta': {'hostvars': {'web1': {'ansible_ssh_host': '10.0.0.1'}, 'db1': {'role': 'db'}}}
+    }
+    generator = PluginInventoryGenerator('test', [lambda args: output], {'cache.dir': str(tmpdir)})
+    dest = tmpdir.mkdir('inventory')
+    generator.generate(str(dest), dict(plugin='<lambda>'))
+
+    inventory = InventoryManager(loader=DataLoader(), sources=[str(dest)])
+
+    assert sorted(h.name for h in inventory.get_hosts('prod')) == ['db1', 'web1', 'web2']
+    assert inventory.get_host('web1').vars['ansible_ssh_host'] == '10.0.0.1'
+    assert inventory.groups['db'].vars == {'port': 5432}
+    assert [h.name for h in inventory.get_hosts('web:&db')] == []
+
+
+@pytest.mark.parametrize('output', [{}, {'_meta': {'hostvars': {}}}, {'web': []}])
+def test_empty_plugin_output_adds_no_hosts(tmpdir, output):
+    from ansible.inventory.manager import InventoryManager
+    from ansible.parsing.dataloader import DataLoader
+
+    generator = PluginInventoryGenerator('test', [lambda args: output], {'cache.dir': str(tmpdir)})
+    dest = tmpdir.mkdir('inventory')
+    generator.generate(str(dest), dict(plugin='<lambda>'))
+
+    inventory = InventoryManager(loader=DataLoader(), sources=[str(dest)])
+
+    assert inventory.get_hosts('all') == []
+
+
+@pytest.mark.parametrize('host', ['host[1:2]', 'db:1'])
+def test_host_names_are_not_expanded_as_patterns(tmpdir, host):
+    from ansible.inventory.manager import InventoryManager
+    from ansible.parsing.dataloader import DataLoader
+
+    output = {'web': [host, 'web1'], '_meta': {'hostvars': {'web1': {'port': 80}}}}
+    generator = PluginInventoryGenerator('test', [lambda args: output], {'cache.dir': str(tmpdir)})
+    dest = tmpdir.mkdir('inventory')
+    generator.generate(str(dest), dict(plugin='<lambda>'))
+
+    inventory = InventoryManager(loader=DataLoader(), sources=[str(dest)])
+
+    assert sorted(inventory.hosts) == sorted([host, 'web1'])
+    assert inventory.get_host('web1').vars['port'] == 80
+    # not parsed as host:port
+    assert 'ansible_port' not in inventory.get_host(host).vars
+
+
+@pytest.fixture
+def inventory_dirs(tmpdir):
+    root = tmpdir.mkdir('root')
+    base = root.mkdir('base')
+    base.join('hosts').write('[web]\nweb1\n')
+    base.mkdir('group_vars').join('web.yml').write('port: 80\n')
+    extra = root.mkdir('extra')
+    extra.mkdir('group_vars').join('web.yml').write('port: 8080\n')
+    return str(root), tmpdir.mkdir('inventory')
+
+
+@pytest.mark.parametrize('link', ['symlink', 'hardlink', 'copy'])
+def test_directory_entries_are_merged(inventory_dirs, link):
+    root_dir, dest = inventory_dirs
+    generator = DirInventoryGenerator(root_dir, {'inventory.directory_link': link})
+
+    generator.generate(str(dest), dict(directory='base'))
+    generator.generate(str(dest), dict(directory='extra'))
+
+    assert dest.join('hosts').read() == '[web]\nweb1\n'
+    assert dest.join('group_vars', 'web.yml').read() == 'port: 8080\n'
+    assert os.path.islink(str(dest.join('hosts'))) == (link == 'symlink')
+    assert (os.lstat(str(dest.join('hosts'))).st_nlink > 1) == (link == 'hardlink')
+    # the sources are left untouched
+    assert open(os.path.join(root_dir, 'base', 'group_vars', 'web.yml')).read() == 'port: 80\n'
+
+
+@pytest.mark.parametrize('link', ['symlink', 'hardlink', 'copy'])
+def test_symlinked_subdirs_are_followed(tmpdir, link):
+    root = tmpdir.mkdir('root')
+    root.mkdir('common').mkdir('group_vars').join('all.yml').write('env: prod\n')
+    cluster = root.mkdir('cluster')
+    cluster.join('hosts').write('[web]\nweb1\n')
+    cluster.join('group_vars').mksymlinkto('../common/group_vars')
+    dest = tmpdir.mkdir('inventory')
+
+    generator = DirInventoryGenerator(str(root), {'inventory.directory_link': link})
+    generator.generate(str(dest), dict(directory='cluster'))
+
+    assert dest.join('group_vars', 'all.yml').read() == 'env: prod\n'
+
+
+@pytest.mark.parametrize('first_link', ['symlink', 'hardlink'])
+def test_copies_do_not_write_through_earlier_links(inventory_dirs, first_link):
+    root_dir, dest = inventory_dirs
+    generator = DirInventoryGenerator(root_dir, {})
+
+    generator.generate(str(dest), dict(directory='base', link=first_link))
+    generator.generate(str(dest), dict(directory='extra', link='copy'))
+
+    assert dest.join('group_vars', 'web.yml').read() == 'port: 8080\n'
+    assert not os.path.islink(str(dest.join('group_vars', 'web.yml')))
+    assert open(os.path.join(root_dir, 'base', 'group_vars', 'web.yml')).read() == 'port: 80\n'
+
+
+def test_hardlinks_fall_back_to_copies_across_filesystems(inventory_dirs, monkeypatch):
+    root_dir, dest = inventory_dirs
+
+    def cross_device_link(source, target):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+    monkeypatch.setattr(os, 'link', cross_device_link)
+    DirInventoryGenerator(root_dir, {}).generate(str(dest), dict(directory='base',
+                                                                 link='hardlink'))
+
+    assert dest.join('hosts').read() == '[web]\nweb1\n'
+    assert os.stat(str(dest.join('hosts'))).st_nlink == 1
+
+
+def test_generated_files_do_not_write_through_links(inventory_dirs):
+    root_dir, dest = inventory_dirs
+    source = os.path.join(root_dir, 'base', 'test-000.json')
+    with open(source, 'w') as f:
+        f.write('{}')
+
+    DirInventoryGenerator(root_dir, {}).generate(str(dest), dict(directory='base'))
+    PluginInventoryGenerator('test', [slow_plugin], {}).generate(
+        str(dest), dict(plugin='slow_plugin', args=dict(name='web', sleep=0)))
+
+    assert open(source).read() == '{}'
+    assert 'web.host' in dest.join('test-000.json').read()
+
+
+@pytest.fixture
+def shell_generator(tmpdir):
+    root = tmpdir.mkdir('root')
+    root.mkdir('clusters')
+    script = root.join('inventory.sh')
+    script.write('#!/bin/bash\necho run >> runs\necho \'{"web": ["\'${1#--name=}\'.host"]}\'\n')
+    script.chmod(0o700)
+
+    ops_config = {'cache.dir': str(tmpdir.join('cache')), 'cache.format': 'json'}
+    cluster_config_path = str(root.join('clusters', 'test.yaml'))
+    generator = ShellInventoryGenerator(cluster_config_path, 'test', ops_config)
+    return generator, root
+
+
+def test_script_output_is_cached_with_its_own_max_age(shell_generator, tmpdir, monkeypatch,
+                                                      caplog):
+    monkeypatch.delenv('REFRESH_CACHE', raising=False)
+    caplog.set_level(logging.INFO, logger='ops.inventory.generator')
+    generator, root = shell_generator
+    dest = tmpdir.mkdir('inventory')
+    entry = dict(script='./inventory.sh', max_age=60, args=dict(name='web1'))
+
+    generator.generate(str(dest), entry)
+    assert 'cached output' not in caplog.text
+    generator.generate(str(dest), entry)
+    assert caplog.text.count('Using the cached output of inventory script') == 1
+    assert root.join('runs').read().count('run') == 1
+    assert 'web1.host' in dest.join('test-000.json').read()
+
+    result = caching.read(caching.get_cache_path(
+        str(tmpdir.join('cache')), dict(script=generator.get_script(entry), root_dir=str(root))))
+    assert result['inventory'] == {'web': ['web1.host']}
+    assert result['size'] > 0 and result['duration'] >= 0
+
+    # other args are cached separately and entries without max_age always run
+    generator.generate(str(dest), dict(entry, args=dict(name='web2')))
+    generator.generate(str(dest), dict(script='./inventory.sh'))
+    assert root.join('runs').read().count('run') == 3
+
+
+@pytest.mark.parametrize('script, error', [
+    ('exit 3', 'Inventory script exit 3 failed with exit code 3'),
+    ('echo not json', 'Inventory script echo not json did not return JSON'),
+])
+def test_failing_script_fails_the_inventory(shell_generator, tmpdir, script, error):
+    generator, root = shell_generator
+    inventory_generator = InventoryGenerator(dict(cluster='test', inventory=[dict(script=script)]),
+                                             FakeSshConfigGenerator(), {'cache.dir': str(tmpdir)},
+                                             [generator])
+
+    with pytest.raises(OpsException) as e:
+        inventory_generator.generate()
+    assert error in str(e.value)
+
+
+def test_missing_inventory_directory_fails_the_inventory(inventory_dirs, tmpdir):
+    root_dir, _ = inventory_dirs
+    cluster_config = dict(cluster='test', inventory=[dict(directory='missing')])
+    inventory_generator = InventoryGenerator(cluster_config, FakeSshConfigGenerator(),
+                                             {'cache.dir': str(tmpdir)},
+                                             [DirInventoryGenerator(root_dir, {})])
+
+    with pytest.raises(OpsException):
+        inventory_generator.generate()
@@ -0,0 +1,60 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+import ops
+from ops.inventory.plugin import LazyPlugin
+
+
+def imported_modules(code):
+    script = code + '\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'
+    return set(json.loads(subprocess.check_output([sys.executable, '-c', script])))
+
+
+def test_main_does_not_import_the_subcommand_dependencies():
+    modules = imported_modules('import ops.main')
+
+    for heavy in ('boto3', 'botocore', 'azure', 'msrestazure', 'requests', 'git', 'pkg_resources',
+                  'ansible.inventory.manager', 'ops.inventory.generator', 'ops.cli.config'):
+        assert heavy not in modules
+
+
+def test_plugins_are_imported_when_called():
+    plugin = LazyPlugin('legacy_pcs')
+    assert plugin.__name__ == 'legacy_pcs'
+    assert plugin.__module__ == 'ops.inventory.plugin.legacy_pcs'
+
+    modules = imported_modules('from ops.inventory.plugin import LazyPlugin\nLazyPlugin("skms")')
+    assert 'ops.inventory.plugin.skms' not in modules
+    assert 'ops.inventory.plugin.skms' in imported_modules('from ops.inventory.plugin import skms')
+
+
+def test_plugin_names_stay_bound_to_functions_after_importing_submodules():
+    code = """
+import importlib, types
+import ops.inventory.plugin.legacy_pcs
+importlib.import_module('ops.inventory.plugin.skms')
+from ops.inventory.plugin import ec2, legacy_pcs, skms
+assert all(isinstance(plugin, types.FunctionType) for plugin in (ec2, legacy_pcs, skms))
+"""
+    subprocess.check_call([sys.executable, '-c', code])
+
+
+def test_version_is_read_from_the_package_metadata():
+    ops.validate_ops_version('0.1')
+
+    with pytest.raises(Exception) as e:
+        ops.validate_ops_version('999.0')
+    assert 'lower than the minimum required version 999.0' in str(e.value)
@@ -0,0 +1,133 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import importlib
+import json
+import re
+import threading
+
+import pytest
+
+from ops.inventory import SKMS
+
+# the plugin package exports the skms function under the module name
+skms_plugin = importlib.import_module('ops.inventory.plugin.skms')
+
+
+def device(index, device_service='Solution - web'):
+    return dict(device_id='%d' % index, name='or1-web-%d.solution.mycompany.net' % index,
+                operating_system=None, device_service=[device_service],
+                environment='Solution - OR1 - Production', primary_ip_address='10.0.0.%d' % index)
+
+
+class FakeResponse(object):
+    def __init__(self, body, cookies):
+        self.text = json.dumps(body)
+        self.cookies = cookies
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    """ Answers the device queries with pages of the given devices """
+
+    instances = []
+    devices = []
+
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+        FakeSession.instances.append(self)
+
+    def post(self, url, data, cookies=None, **kwargs):
+        parameters = json.loads(data['_parameters'])
+        with self._lock:
+            self.requests.append(dict(parameters=parameters, cookies=cookies))
+
+        query = parameters['request_arr'][0]['parameters']['query']
+        page, page_size = map(int, re.search(r'PAGE (\d+), (\d+)$', query).groups())
+        results = self.devices[(page - 1) * page_size:page * page_size]
+        body = dict(status='success', data=dict(result_arr=[dict(data=dict(results=results))]))
+        return FakeResponse(body, {'SkmsSID': 'session-1', 'csrf_token': 'token-1'})
+
+
+@pytest.fixture
+def session(monkeypatch, tmpdir):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    FakeSession.instances = []
+    FakeSession.devices = []
+    monkeypatch.setattr(SKMS.requests, 'Session', FakeSession)
+    return lambda: FakeSession.instances[-1]
+
+
+def test_pages_are_fetched_concurrently_in_order(session):
+    FakeSession.devices = [device(i) for i in range(11)]
+    conn = SKMS.WebApiClient('user', 'secret', 'api.skms.test', enable_session_optimization=True)
+
+    devices = list(skms_plugin.fetch_devices(conn, 'Solution - OR1 - Production', page_size=3,
+                                             concurrency=2))
+
+    assert [info['device_id'] for info in devices] == ['%d' % i for i in range(11)]
+    # all the pages go through the one pooled session, the ones after the first reuse its
+    # SKMS session
+    requests = session().requests
+    assert len(FakeSession.instances) == 1
+    assert len(requests) >= 4
+    assert requests[0]['cookies'] is None
+    assert all(request['cookies'] == {'SkmsSID': 'session-1'} for request in requests[1:])
+    assert all(request['parameters']['csrf_token'] == 'token-1' for request in requests[1:])
+
+
+def test_session_is_reused_across_runs(session, tmpdir):
+    conn = SKMS.WebApiClient('user', 'secret', 'api.skms.test', enable_session_optimization=True)
+    conn.send_request('SkmsWebApi', 'performMultipleRequests', dict(
+        request_arr=[dict(parameters=dict(query='SELECT device_id PAGE 1, 10'))]))
+
+    assert json.loads(tmpdir.join('.skms', 'sess_user.json').read()) == dict(
+        skms_session_id='session-1', skms_csrf_token='token-1')
+
+    conn = SKMS.WebApiClient('user', 'secret', 'api.skms.test', enable_session_optimization=True)
+    assert conn.get_skms_session_id() == 'session-1'
+    assert conn.get_skms_csrf_token() == 'token-1'
+
+
+def test_groups_are_built_once_per_host(session, tmpdir):
+    tmpdir.mkdir('.skms').join('credentials.yaml').write('username: user\npassword: secret\n')
+    # or1-web-1 comes back twice, or1-web-5 has no ip
+    FakeSession.devices = [device(i) for i in range(3)] + [
+        device(1), device(3, 'Solution - db'), device(4, 'Other - web'),
+        dict(device(5), primary_ip_address=None)]
+
+    inventory = skms_plugin.skms(dict(
+        skms=dict(endpoint='api.skms.test'), environment='Solution - OR1 - Production',
+        page_size=3,
+        strip=dict(device_service='Solution - ', environment='Solution - OR1 - ',
+                   hostname='.solution.mycompany.net')))
+
+    hosts = ['or1-web-%d' % i for i in range(5)]
+    assert inventory['web']['hosts'] == hosts[:3]
+    assert inventory['db']['hosts'] == ['or1-web-3']
+    assert inventory['Other - web']['hosts'] == ['or1-web-4']
+    assert inventory['Production']['hosts'] == hosts
+    assert inventory['or1']['hosts'] == hosts
+    assert inventory['or1-web']['hosts'] == hosts
+    assert inventory['10.0.0.1']['hosts'] == ['or1-web-1']
+    assert inventory['Solution']['hosts'] == hosts
+    assert all(isinstance(name, str) for name in inventory)
+
+    hostvars = inventory['_meta']['hostvars']
+    assert sorted(hostvars) == hosts
+    assert hostvars['or1-web-3']['ansible_host'] == '10.0.0.3'
+    assert hostvars['or1-web-3']['tags']['role'] == 'db'
+    assert hostvars['or1-web-3']['tags']['cluster'] == 'or1-web'
+    # the inventory is written as JSON
+    assert json.loads(json.dumps(inventory)) == inventory
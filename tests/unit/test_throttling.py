@@ -0,0 +1,80 @@
+#Copyright 2019 Adobe. All rights reserved.
+#This file is licensed to you under the Apache License, Version 2.0 (the "License");
+#you may not use this file except in compliance with the License. You may obtain a copy
+#of the License at http://www.apache.org/licenses/LICENSE-2.0
+
+#Unless required by applicable law or agreed to in writing, software distributed under
+#the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR REPRESENTATIONS
+#OF ANY KIND, either express or implied. See the License for the specific language
+#governing permissions and limitations under the License.
+
+import pytest
+
+from ops.inventory import throttling
+
+
+class ThrottledError(Exception):
+    status_code = 429
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # a clock that only moves when sleeping
+    sleeps = []
+    monkeypatch.setattr(throttling.time, 'time', lambda: 1000 + sum(sleeps))
+    monkeypatch.setattr(throttling.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def flaky(failures):
+    calls = []
+
+    def call():
+        calls.append(True)
+        if len(calls) <= failures:
+            raise ThrottledError()
+        return len(calls)
+
+    return call
+
+
+def test_bucket_waits_once_the_burst_is_spent(sleeps):
+    bucket = throttling.TokenBucket(rate=10, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    assert sleeps == []
+
+    assert bucket.acquire() == pytest.approx(0.1)
+    assert bucket.acquire() == pytest.approx(0.1)
+
+
+def test_throttled_calls_are_retried_and_slow_down(sleeps):
+    throttler = throttling.create('azure', dict(rate=1000, burst=1000))
+
+    assert throttler.call(flaky(2)) == 3
+    assert throttler.stats()['retries'] == 2
+    assert throttler.bucket.rate < 1000
+
+
+def test_retries_are_bounded(sleeps):
+    throttler = throttling.create('skms', dict(rate=1000, burst=1000, max_retries=2,
+                                               retry_budget=3))
+
+    with pytest.raises(ThrottledError):
+        throttler.call(flaky(5))
+
+    with pytest.raises(throttling.RetryBudgetExceeded):
+        throttler.call(flaky(5))
+
+    # other errors are not retried
+    with pytest.raises(ValueError):
+        throttler.call(int, 'x')
+    assert throttler.stats()['retries'] == 3
+
+
+def test_configure_reads_the_provider_limits():
+    throttling.configure({'inventory.throttling.ec2': {'rate': 3, 'max_retries': 1}})
+
+    ec2 = throttling.get('ec2')
+    assert (ec2.max_rate, ec2.bucket.burst, ec2.max_retries) == (3, 10, 1)
+    assert throttling.get('skms').max_rate == throttling.DEFAULT_LIMITS['rate']